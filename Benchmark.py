@@ -0,0 +1,166 @@
+""" Throughput benchmarks of the template engine.
+
+    python Benchmark.py threads [--max-threads N] [--seconds S]
+
+measures how many templates per second are compiled (lexed, parsed,
+optimized and turned into code) and rendered with 1 to N threads sharing one
+lexer. On a free-threaded CPython build the numbers should grow with the
+thread count; with the GIL they stay flat.
+
+    python Benchmark.py parser [--repeat N]
+
+compares the time the parser takes on an expression-heavy template with
+that of the recursive descent expression parser it replaced.
+
+    python Benchmark.py vm [--repeat N]
+
+compares the render time and the pickled size of the node tree, of the
+instruction stream run by VirtualMachine, and of the generated code.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import marshal
+import pickle
+import sys
+import time
+from DescentParser import DescentParser
+from Lexer import ArrayTokenStream, Lexer
+from Parser import Parser
+from Template import Template
+import VirtualMachine
+
+SOURCE = '''<table>
+{% for row in rows %}<tr class="{{ "odd" if odd(row.index) else "even" }}">
+  {% for cell in row.cells %}<td>{{ cell.value * 2 + 1 }}</td>{% endfor %}
+  {% if row.total > 10 and not row.hidden %}<td>{{ row.total }}</td>{% else %}<td>-</td>{% endif %}
+</tr>{% endfor %}
+</table>
+'''
+
+
+class Cell(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class Row(object):
+    def __init__(self, index):
+        self.index = index
+        self.cells = [Cell(i) for i in range(5)]
+        self.total = index * 3
+        self.hidden = index % 7 == 0
+
+
+ROWS = [Row(i) for i in range(20)]
+
+EXPRESSION_SOURCE = ('{{ a + b * c - d / e // f % g ** h }}'
+                     '{{ x if a and not b or c else y }}'
+                     '{{ (a < b) == (c >= d) and e in [1, 2, 3] and f not in g }}'
+                     '{{ -a.b[c] + +d(e, f)[1:2] * "text" }}'
+                     '{% if user.name and user.age > 18 %}{{ title(user.name) }}{% endif %}') * 50
+
+
+def gil_description():
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is None:
+        return 'GIL'
+    return 'GIL' if is_gil_enabled() else 'free-threaded'
+
+
+def compile_once(index):
+    # A distinct source per call and no cache: every call really compiles
+    Template(SOURCE + '<!-- %d -->' % index, cache=None)
+
+
+def render_once(template):
+    template.render(rows=ROWS)
+
+
+def measure(threads, seconds, work, argument):
+    """ Returns the number of calls of work per second done by threads threads together """
+    deadline = time.perf_counter() + seconds
+
+    def worker(thread_index):
+        count = 0
+        while time.perf_counter() < deadline:
+            work(argument(thread_index, count))
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(worker, range(threads)))
+    return total / (time.perf_counter() - start)
+
+
+def benchmark_threads(max_threads, seconds):
+    template = Template(SOURCE)
+    print('Python %s (%s)' % (sys.version.split()[0], gil_description()))
+    print('%8s %16s %16s' % ('threads', 'compiles/s', 'renders/s'))
+    for threads in range(1, max_threads + 1):
+        compiles = measure(threads, seconds, compile_once, lambda thread, count: thread * 10 ** 9 + count)
+        renders = measure(threads, seconds, render_once, lambda thread, count: template)
+        print('%8d %16.0f %16.0f' % (threads, compiles, renders))
+
+
+def benchmark_parser(repeat):
+    lexer = Lexer()
+    tokens = lexer.tokenize_all(EXPRESSION_SOURCE).tokens[:-1]
+    parser_classes = (DescentParser, Parser)
+    best = dict((parser_class, float('inf')) for parser_class in parser_classes)
+    # Alternating the parsers spreads the noise of the machine evenly between them
+    for _ in range(repeat):
+        for parser_class in parser_classes:
+            parser = parser_class(lexer, EXPRESSION_SOURCE, ArrayTokenStream(tokens))
+            start = time.perf_counter()
+            parser.parse()
+            best[parser_class] = min(best[parser_class], time.perf_counter() - start)
+
+    print('%-24s %12s' % ('parser', 'ms'))
+    for parser_class in parser_classes:
+        print('%-24s %12.2f' % (parser_class.__name__, best[parser_class] * 1000))
+
+
+def benchmark_vm(repeat):
+    template = Template(SOURCE, cache=None)
+    program = VirtualMachine.assemble(template.root)
+    renderers = [('tree', template.root.render, len(pickle.dumps(template.root))),
+                 ('vm', program.render, len(program.dumps())),
+                 ('generated code', template.render_function, len(marshal.dumps(template.code)))]
+    best = dict((name, float('inf')) for name, _, _ in renderers)
+    for _ in range(repeat):
+        for name, render, _ in renderers:
+            start = time.perf_counter()
+            render({'rows': ROWS})
+            best[name] = min(best[name], time.perf_counter() - start)
+
+    print('%-24s %12s %12s' % ('renderer', 'ms', 'bytes'))
+    for name, _, size in renderers:
+        print('%-24s %12.3f %12d' % (name, best[name] * 1000, size))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    threads = subparsers.add_parser('threads', help='compile and render throughput from 1 to N threads')
+    threads.add_argument('--max-threads', type=int, default=8)
+    threads.add_argument('--seconds', type=float, default=1.0, help='duration of each measurement')
+
+    parsers = subparsers.add_parser('parser', help='expression parsing time, against the recursive descent parser')
+    parsers.add_argument('--repeat', type=int, default=20, help='the best of that many parses is shown')
+
+    vm = subparsers.add_parser('vm', help='render time of the instruction stream, against the tree and the generated code')
+    vm.add_argument('--repeat', type=int, default=200, help='the best of that many renders is shown')
+
+    options = parser.parse_args(arguments)
+    if options.benchmark == 'threads':
+        benchmark_threads(options.max_threads, options.seconds)
+    elif options.benchmark == 'parser':
+        benchmark_parser(options.repeat)
+    elif options.benchmark == 'vm':
+        benchmark_vm(options.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import errno
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+# Bump whenever the generated code changes, so stale cache files are never loaded
+ENGINE_VERSION = '12'
+
+
+class FileSystemBytecodeCache(object):
+    """ Stores the code objects of compiled templates in a directory.
+
+    Files are named after a hash of the template source, the engine version and
+    the Python version, and are written atomically (temporary file + rename),
+    so several processes can share one directory.
+    """
+
+    def __init__(self, directory, pattern='__template_%s.cache'):
+        self.directory = directory
+        self.pattern = pattern
+
+    def get_cache_key(self, source):
+        key = hashlib.sha1()
+        key.update(ENGINE_VERSION.encode())
+        key.update(sys.version.encode())
+        key.update(source.encode('utf-8', 'surrogatepass'))
+        return key.hexdigest()
+
+    def get_cache_filename(self, key):
+        return os.path.join(self.directory, self.pattern % key)
+
+    def load(self, key):
+        """ Returns the cached code object, or None on a miss """
+        try:
+            with open(self.get_cache_filename(key), 'rb') as cache_file:
+                return marshal.load(cache_file)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def dump(self, key, code):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temporary_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError as error:
+            if error.errno in (errno.EACCES, errno.EROFS):
+                return
+            raise
+
+        try:
+            with os.fdopen(descriptor, 'wb') as cache_file:
+                marshal.dump(code, cache_file)
+            os.replace(temporary_filename, self.get_cache_filename(key))
+        except BaseException:
+            try:
+                os.remove(temporary_filename)
+            except OSError:
+                pass
+            raise
+
+    def clear(self):
+        prefix, suffix = self.pattern.split('%s')
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith(suffix):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+from BytecodeCache import FileSystemBytecodeCache
+from Template import Template
+
+
+class FileSystemBytecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = FileSystemBytecodeCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compiled_template_is_stored(self):
+        Template('{{ foo }}', bytecode_cache=self.cache, cache=None)
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+    def test_cache_hit_does_not_parse_the_source(self):
+        Template('{% for i in foo %}{{ i }}{% endfor %}', bytecode_cache=self.cache, cache=None)
+        template = Template('{% for i in foo %}{{ i }}{% endfor %}', bytecode_cache=self.cache, cache=None)
+
+        self.assertIsNone(template._root)
+        self.assertEqual('123', template.render(foo=[1, 2, 3]))
+
+    def test_different_sources_get_different_keys(self):
+        self.assertNotEqual(self.cache.get_cache_key('{{ a }}'), self.cache.get_cache_key('{{ b }}'))
+
+    def test_corrupted_file_is_a_miss(self):
+        key = self.cache.get_cache_key('{{ foo }}')
+        with open(self.cache.get_cache_filename(key), 'wb') as cache_file:
+            cache_file.write(b'garbage')
+
+        self.assertIsNone(self.cache.load(key))
+        self.assertEqual('bar', Template('{{ foo }}', bytecode_cache=self.cache, cache=None).render(foo='bar'))
+
+    def test_clear_removes_cache_files(self):
+        Template('{{ foo }}', bytecode_cache=self.cache, cache=None)
+        self.cache.clear()
+        self.assertEqual([], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
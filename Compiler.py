@@ -0,0 +1,473 @@
+import asyncio
+import inspect
+import keyword
+import math
+import Node
+from Parser import NodeVisitor
+
+_compare_operator_to_source = {
+    'eq': '==',
+    'ne': '!=',
+    'gt': '>',
+    'gteq': '>=',
+    'lt': '<',
+    'lteq': '<=',
+    'in': 'in',
+    'notin': 'not in'
+}
+
+# Python precedence of the source generated for each node: an operand is parenthesized only when it binds
+# less tightly than its position requires, so that long chains (a + b + ..., a.b.c...) nest no parentheses
+_precedence = {
+    'Cond': 1,
+    'Or': 2,
+    'And': 3,
+    'Not': 4,
+    'Compare': 5,
+    'Add': 9, 'Sub': 9,
+    'Mul': 10, 'Div': 10, 'FloorDiv': 10, 'Mod': 10,
+    'Neg': 11, 'Pos': 11,
+    'Pow': 12
+}
+# Atoms, attributes, subscriptions and calls
+_primary_precedence = 14
+
+
+def missing_else():
+    raise Exception('Conditional expression has no else clause')
+
+
+async def auto_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def auto_aiter(iterable):
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def resolve_async(name, context):
+    """ Like Node.resolve_in_context, but awaits the value the first time it is used """
+    for scope in reversed(context):
+        if name in scope:
+            value = scope[name]
+            if inspect.isawaitable(value):
+                value = await value
+                # The globals layer is read-only: only the values of the render are replaced
+                if scope is not context[0]:
+                    scope[name] = value
+            return value
+    raise Exception('Variable %s was not found' % name)
+
+
+async def prefetch(context, names):
+    """ Awaits, all at once, the awaitable variables that the template is certain to use """
+    scope = context[-1]
+    pending = [name for name in names if name in scope and inspect.isawaitable(scope[name])]
+    if pending:
+        values = await asyncio.gather(*[scope[name] for name in pending])
+        scope.update(zip(pending, values))
+
+
+def literal(value):
+    """ Returns Python source evaluating to value (only for the values a Value node can hold) """
+    if isinstance(value, float) and not math.isfinite(value):
+        return 'float(%r)' % str(value)
+    elif isinstance(value, tuple):
+        if len(value) == 1:
+            return '(%s,)' % literal(value[0])
+        return '(%s)' % ', '.join(literal(item) for item in value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        # A folded -2 must stay one operand: -2 ** n is -(2 ** n) in Python
+        return '(%r)' % value
+    return repr(value)
+
+
+def is_plain_attribute(attr):
+    return isinstance(attr, str) and attr.isascii() and attr.isidentifier() and not keyword.iskeyword(attr)
+
+
+class UnconditionalNames(NodeVisitor):
+    """ Collects the variables that are evaluated on every render, whatever the branches taken """
+
+    def __init__(self):
+        self.names = []
+
+    def visit_Variable(self, node):
+        if node.name not in self.names:
+            self.names.append(node.name)
+
+    def visit_If(self, node):
+        self.visit(node.test)
+
+    def visit_For(self, node):
+        self.visit(node.items)
+
+    def visit_Cond(self, node):
+        self.visit(node.test)
+
+    def visit_And(self, node):
+        self.visit(node.left)
+
+    visit_Or = visit_And
+
+    def visit_Compare(self, node):
+        # Operands after the first comparison are only evaluated if it holds
+        self.visit(node.expr)
+        self.visit(node.ops[0].expr)
+
+
+class CodeGenerator(NodeVisitor):
+    """ Turns the tree built by Parser.parse() into the source of a Python module.
+
+    The module defines render(context), which returns the same string as
+    Node.Template.render(context) without walking the tree at render time,
+    generate(context), which yields that string in chunks, and the async
+    generator generate_async(context), which awaits the values it uses.
+    The render() methods of the nodes remain the reference implementation.
+    Blocks nested deeper than MAX_BLOCK_DEPTH continue in helper functions,
+    since Python bounds the nesting of blocks within one function.
+    """
+
+    MAX_BLOCK_DEPTH = 10
+
+    def __init__(self):
+        self.lines = []
+        self.indentation = 0
+        self.identifier_count = 0
+        self.constants = {}
+        self.mode = 'render'
+        self.helper_lines = []
+        self.helper_count = 0
+        # Slots of the enclosing analysed loops, whose locals a helper function takes as arguments
+        self.slots = []
+
+    def generate(self, node):
+        self.visit(node)
+        constants = ['%s = %s' % (name, source) for source, name in self.constants.items()]
+        return '\n'.join(constants + self.helper_lines + self.lines) + '\n'
+
+    def writeline(self, line):
+        self.lines.append('    ' * self.indentation + line)
+
+    def indent(self):
+        self.indentation += 1
+
+    def outdent(self):
+        self.indentation -= 1
+
+    def temporary_identifier(self):
+        self.identifier_count += 1
+        return 't_%d' % self.identifier_count
+
+    ###########################################################################
+    #                                                                         #
+    #                              Statements                                 #
+    #                                                                         #
+    ###########################################################################
+
+    def visit_Template(self, node):
+        # A template that is only text (once optimized) renders to a precomputed string
+        if all(isinstance(item, Node.Value) for item in node.body):
+            self.writeline('static_output = %r' % ''.join(str(item.value) for item in node.body))
+            self.writeline('def render(context=None):')
+            self.indent()
+            self.writeline('return static_output')
+            self.outdent()
+            self.writeline('def render_in(context):')
+            self.indent()
+            self.writeline('return static_output')
+            self.outdent()
+            self.writeline('def generate(context=None):')
+            self.indent()
+            self.writeline('yield static_output')
+            self.outdent()
+            self.writeline('async def generate_async(context=None):')
+            self.indent()
+            self.writeline('yield static_output')
+            self.outdent()
+            return
+
+        unconditional_names = UnconditionalNames()
+        for item in node.body:
+            unconditional_names.visit(item)
+
+        self.writeline('static_output = None')
+        self.writeline('eager_names = %r' % (tuple(unconditional_names.names), ))
+        self.write_function('render_in', node.body, mode='render')
+        self.writeline('def render(context=None):')
+        self.indent()
+        self.writeline('return render_in(build_context(context))')
+        self.outdent()
+        self.write_function('generate', node.body, mode='generate')
+        self.write_function('generate_async', node.body, mode='async')
+
+    def write_function(self, name, body, mode):
+        """ render_in() joins the output of the body, generate() and generate_async() yield it chunk by chunk.
+
+        render_in() takes an already built scope stack, so that callers rendering
+        many times can build the builtins once; render() builds it first.
+        """
+        self.mode = mode
+        if mode == 'async':
+            self.writeline('async def %s(context=None):' % name)
+        elif mode == 'generate':
+            self.writeline('def %s(context=None):' % name)
+        else:
+            self.writeline('def %s(context):' % name)
+        self.indent()
+        if mode != 'render':
+            self.writeline('context = build_context(context)')
+        if mode == 'async':
+            self.writeline('await prefetch(context, eager_names)')
+            self.write_body(body)
+            self.writeline('return')
+            # Keeps the function an async generator even when the body has no output
+            self.writeline('yield')
+        elif mode == 'generate':
+            self.write_body(body)
+            # Keeps the function a generator even when the body has no output
+            self.writeline('yield from ()')
+        else:
+            self.writeline('buffer = []')
+            self.writeline('append = buffer.append')
+            self.write_body(body)
+            self.writeline("return ''.join(buffer)")
+        self.outdent()
+
+    def write_body(self, body):
+        if not body:
+            self.writeline('pass')
+        elif self.indentation > self.MAX_BLOCK_DEPTH and any(isinstance(item, (Node.If, Node.For)) for item in body):
+            self.write_helper(body)
+        else:
+            for item in body:
+                self.write_output(item)
+
+    def write_helper(self, body):
+        """ Writes body into a new module-level function, and a call to it in place of the body. """
+        self.helper_count += 1
+        name = 'h_%d' % self.helper_count
+        parameters = ['context'] + (['append'] if self.mode == 'render' else []) + ['l_%d' % slot for slot in self.slots]
+        lines, indentation = self.lines, self.indentation
+        self.lines, self.indentation = [], 0
+        self.writeline('%sdef %s(%s):' % ('async ' if self.mode == 'async' else '', name, ', '.join(parameters)))
+        self.indent()
+        self.write_body(body)
+        if self.mode == 'async':
+            self.writeline('return')
+            self.writeline('yield')
+        elif self.mode == 'generate':
+            self.writeline('yield from ()')
+        self.outdent()
+        self.helper_lines.extend(self.lines)
+        self.lines, self.indentation = lines, indentation
+
+        call = '%s(%s)' % (name, ', '.join(parameters))
+        if self.mode == 'async':
+            # The helper awaits its own copies of the locals: awaiting them here first keeps both in step
+            for slot in self.slots:
+                self.writeline('l_%d = await auto_await(l_%d)' % (slot, slot))
+            identifier = self.temporary_identifier()
+            self.writeline('async for %s in %s:' % (identifier, call))
+            self.indent()
+            self.writeline('yield %s' % identifier)
+            self.outdent()
+        elif self.mode == 'generate':
+            self.writeline('yield from %s' % call)
+        else:
+            self.writeline(call)
+
+    def write_output(self, node):
+        if isinstance(node, (Node.If, Node.For)):
+            self.visit(node)
+        elif isinstance(node, Node.Value):
+            self.emit(repr(str(node.value)))
+        else:
+            self.emit('str(%s)' % self.visit(node))
+
+    def emit(self, source):
+        if self.mode != 'render':
+            self.writeline('yield %s' % source)
+        else:
+            self.writeline('append(%s)' % source)
+
+    def visit_If(self, node):
+        self.writeline('if %s:' % self.visit(node.test))
+        self.indent()
+        self.write_body(node.body)
+        self.outdent()
+        if node.else_body:
+            self.writeline('else:')
+            self.indent()
+            self.write_body(node.else_body)
+            self.outdent()
+
+    def visit_For(self, node):
+        if node.slot is not None:
+            # Analysed loop (see Scope): the item goes into a local, which its variables read directly
+            identifier = 'l_%d' % node.slot
+            if self.mode == 'async':
+                self.writeline('async for %s in auto_aiter(%s):' % (identifier, self.visit(node.items)))
+            else:
+                self.writeline('for %s in %s:' % (identifier, self.visit(node.items)))
+            self.indent()
+            self.slots.append(node.slot)
+            self.write_body(node.body)
+            self.slots.pop()
+            self.outdent()
+            return
+
+        identifier = self.temporary_identifier()
+        if self.mode == 'async':
+            self.writeline('async for %s in auto_aiter(%s):' % (identifier, self.visit(node.items)))
+        else:
+            self.writeline('for %s in %s:' % (identifier, self.visit(node.items)))
+        self.indent()
+        self.writeline('context.append({%s: %s})' % (self.visit(node.target), identifier))
+        self.write_body(node.body)
+        self.writeline('context.pop()')
+        self.outdent()
+
+    ###########################################################################
+    #                                                                         #
+    #                              Expressions                                #
+    #                                                                         #
+    ###########################################################################
+
+    def visit_Value(self, node):
+        # Tuples are built once, when the module is loaded, instead of on every evaluation
+        if isinstance(node.value, tuple):
+            source = literal(node.value)
+            return self.constants.setdefault(source, 'c_%d' % len(self.constants))
+        return literal(node.value)
+
+    def visit_Variable(self, node):
+        if node.slot is not None:
+            if self.mode == 'async':
+                # Awaited on first use and stored back, like resolve_async() does in a scope
+                return '(l_%d := await auto_await(l_%d))' % (node.slot, node.slot)
+            return 'l_%d' % node.slot
+        if self.mode == 'async':
+            return '(await resolve_async(%r, context))' % node.name
+        return 'resolve(%r, context)' % node.name
+
+    def visit_List(self, node):
+        return '[%s]' % ', '.join(self.visit(item) for item in node.items)
+
+    def visit_Tuple(self, node):
+        if len(node.items) == 1:
+            return '(%s,)' % self.visit(node.items[0])
+        return '(%s)' % ', '.join(self.visit(item) for item in node.items)
+
+    def visit_Dict(self, node):
+        return '{%s}' % ', '.join(self.visit(item) for item in node.items)
+
+    def visit_Pair(self, node):
+        return '%s: %s' % (self.visit(node.key), self.visit(node.value))
+
+    def visit_Slice(self, node):
+        def const(item):
+            return self.visit(item) if item else 'None'
+
+        return 'slice(%s, %s, %s)' % (const(node.start), const(node.stop), const(node.step))
+
+    def visit_operand(self, node, precedence):
+        """ The source of node, parenthesized if it binds less tightly than precedence """
+        source = self.visit(node)
+        if _precedence.get(type(node).__name__, _primary_precedence) < precedence:
+            return '(%s)' % source
+        return source
+
+    def visit_Cond(self, node):
+        if isinstance(node.else_expr, Node.Cond):
+            # Already a string: chained conditions stay flat, as in 'a if b else c if d else e'
+            else_expr = self.visit(node.else_expr)
+        elif node.else_expr:
+            else_expr = 'str(%s)' % self.visit(node.else_expr)
+        else:
+            else_expr = 'missing_else()'
+        return 'str(%s) if %s else %s' % (self.visit(node.if_expr), self.visit_operand(node.test, _precedence['Or']),
+                                          else_expr)
+
+    def visit_BinaryExpr(self, node):
+        precedence = _precedence[type(node).__name__]
+        # Operators are left-associative, but for ** which is right-associative in Python
+        left_precedence, right_precedence = precedence, precedence + 1
+        if isinstance(node, Node.Pow):
+            left_precedence, right_precedence = precedence + 1, precedence
+        return '%s %s %s' % (self.visit_operand(node.left, left_precedence), node.operator,
+                             self.visit_operand(node.right, right_precedence))
+
+    visit_And = visit_Or = visit_BinaryExpr
+    visit_Add = visit_Sub = visit_Mul = visit_Div = visit_BinaryExpr
+    visit_FloorDiv = visit_Mod = visit_Pow = visit_BinaryExpr
+
+    def visit_UnaryExpr(self, node):
+        return '%s %s' % (node.operator, self.visit_operand(node.node, _precedence[type(node).__name__]))
+
+    visit_Not = visit_Neg = visit_Pos = visit_UnaryExpr
+
+    def visit_Compare(self, node):
+        # An operand that is itself a comparison is parenthesized: it must not join the chain
+        operand_precedence = _precedence['Compare'] + 1
+        parts = [self.visit_operand(node.expr, operand_precedence)]
+        for op in node.ops:
+            parts.append(_compare_operator_to_source[op.operator])
+            parts.append(self.visit_operand(op.expr, operand_precedence))
+        return ' '.join(parts)
+
+    def visit_GetAttr(self, node):
+        if is_plain_attribute(node.attr):
+            return '%s.%s' % (self.visit_operand(node.node, _primary_precedence), node.attr)
+        return 'getattr(%s, %r)' % (self.visit(node.node), node.attr)
+
+    def visit_GetItem(self, node):
+        return '%s[%s]' % (self.visit_operand(node.node, _primary_precedence), self.visit(node.name))
+
+    def visit_Call(self, node):
+        args = [self.visit(arg) for arg in node.args]
+
+        if node.dyn_args is not None:
+            args.append('*%s' % self.visit(node.dyn_args))
+
+        for kwarg in node.kwargs:
+            args.append('**{%r: %s}' % (kwarg.key.name, self.visit(kwarg.value)))
+
+        if node.dyn_kwargs is not None:
+            args.append('**%s' % self.visit(node.dyn_kwargs))
+
+        call = '%s(%s)' % (self.visit_operand(node.node, _primary_precedence), ', '.join(args))
+        if self.mode == 'async':
+            return '(await auto_await(%s))' % call
+        return call
+
+
+def generate(node):
+    return CodeGenerator().generate(node)
+
+
+def compile_template(node, filename='<template>'):
+    """ Returns the code object of the module generated for a Node.Template """
+    return compile(generate(node), filename, 'exec')
+
+
+def load(code):
+    """ Executes a compiled template module and returns its namespace """
+    namespace = {
+        'build_context': Node.build_context,
+        'resolve': Node.resolve_in_context,
+        'missing_else': missing_else,
+        'auto_await': auto_await,
+        'auto_aiter': auto_aiter,
+        'resolve_async': resolve_async,
+        'prefetch': prefetch
+    }
+    exec(code, namespace)
+    return namespace
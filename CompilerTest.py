@@ -0,0 +1,153 @@
+import asyncio
+import time
+import unittest
+from Lexer import Lexer
+from Parser import Parser
+import ParserTest
+from Template import Template
+import Compiler
+from Optimizer import optimize
+
+
+def compiled_outputs(parsed_source, items):
+    """ The outputs of render(), generate() and generate_async() of the code generated for parsed_source """
+    namespace = Compiler.load(Compiler.compile_template(parsed_source))
+
+    async def render_async():
+        return ''.join([chunk async for chunk in namespace['generate_async'](dict(items))])
+
+    return [namespace['render'](items), ''.join(namespace['generate'](items)), asyncio.run(render_async())]
+
+
+class CompilerTest(ParserTest.ParserTest):
+    """ Runs every parser test again through the generated code """
+
+    def render_outputs(self, parsed_source):
+        return compiled_outputs(parsed_source, self.items)
+
+    def test_generated_code_matches_reference_renderer(self):
+        source = '{% for i in range(4) %}{% if odd(i) %}{{ i * 2 }}{% else %}-{% endif %}{% endfor %}'
+        parsed_source = Parser(Lexer(), source).parse()
+        render = Compiler.load(Compiler.compile_template(parsed_source))['render']
+        self.assertEqual(parsed_source.render({}), render({}))
+
+    def test_cond_without_else_raises(self):
+        parsed_source = Parser(Lexer(), '{{ 1 if foo }}').parse()
+        render = Compiler.load(Compiler.compile_template(parsed_source))['render']
+        self.assertEqual('1', render({'foo': True}))
+        self.assertRaises(Exception, render, {'foo': False})
+
+    def test_folded_negative_numbers_keep_their_precedence(self):
+        for source, items in [('{{ -2 ** n }}', {'n': 2}), ('{{ -1 ** -b }}', {'b': 0}), ('{{ -2.5 ** n }}', {'n': 2})]:
+            parsed_source = optimize(Parser(Lexer(), source).parse())
+            render = Compiler.load(Compiler.compile_template(parsed_source))['render']
+            self.assertEqual(Parser(Lexer(), source).parse().render(items), render(items), source)
+
+    def test_attributes_of_numbers(self):
+        for source in ['{{ 1.real }}', '{{ (-2).real }}', '{{ -1 .real }}', '{{ 2.5.imag }}']:
+            self.assertEqual(Parser(Lexer(), source).parse().render({}), Template(source, cache=None).render(), source)
+
+    def test_deeply_nested_blocks(self):
+        loops = ''.join('{%% for i%d in items %%}' % depth for depth in range(25)) + '{{ i0 }}{{ i24 }}' + '{% endfor %}' * 25
+        template = Template(loops, cache=None)
+        self.assertEqual('aa', template.render(items='a'))
+        self.assertEqual('11', ''.join(template.generate(items=[1])))
+        conditions = '{% for x in items %}' + '{% if a %}' * 120 + '{{ x }}' + '{% endif %}' * 120 + '{% endfor %}'
+        template = Template(conditions, cache=None, limits={'max_depth': None})
+        self.assertEqual('12', template.render(a=True, items=[1, 2]))
+        self.assertEqual('12', ''.join(template.generate(a=True, items=[1, 2])))
+
+    def test_long_expression_chains(self):
+        # Each operand used to add a pair of parentheses, and Python nests at most 200
+        items = {'a': 1, 'c': False}
+        for source in ['{{ ' + ' + '.join(['a'] * 300) + ' }}', '{{ a' + '.real' * 300 + ' }}', '{{ ' + '-' * 300 + 'a }}',
+                       '{{ ' + 'a if c else ' * 150 + 'a }}', '{{ ' + ' and '.join(['a'] * 300) + ' }}']:
+            parsed_source = Parser(Lexer(), source).parse()
+            self.assertEqual([parsed_source.render(items)] * 3, compiled_outputs(parsed_source, items))
+
+    def test_operands_keep_their_precedence(self):
+        for source in ['{{ (a + b) * c }}', '{{ a - (b - c) }}', '{{ (a ** b) ** c }}', '{{ a ** b ** c }}',
+                       '{{ (-a) ** b }}', '{{ -a ** b }}', '{{ (a < b) == c }}', '{{ not (a and b) }}',
+                       '{{ (a if c else b) * a }}', '{{ a if (c if a else b) else b }}', '{{ (a or b).real }}']:
+            parsed_source = Parser(Lexer(), source).parse()
+            items = {'a': 2, 'b': 3, 'c': 0}
+            self.assertEqual([parsed_source.render(items)] * 3, compiled_outputs(parsed_source, items), source)
+
+    def test_template_uses_generated_code(self):
+        template = Template('{% for name in names %}<{{ name.upper() }}>{% endfor %}')
+        self.assertEqual('<A><B>', template.render(names=['a', 'b']))
+
+    def test_generate_yields_before_rendering_everything(self):
+        def rows():
+            yield 'first'
+            raise RuntimeError('the rest of the output was rendered eagerly')
+
+        stream = Template('{% for row in rows %}<{{ row }}>{% endfor %}').generate(rows=rows())
+        self.assertEqual(['<', 'first', '>'], [next(stream), next(stream), next(stream)])
+        self.assertRaises(RuntimeError, next, stream)
+
+    def test_reference_generate_matches_render(self):
+        parsed_source = Parser(Lexer(), 'a{% for i in foo %}{% if i %}{{ i }}{% else %}-{% endif %}{% endfor %}').parse()
+        self.assertEqual(parsed_source.render({'foo': [1, 0, 2]}), ''.join(parsed_source.generate({'foo': [1, 0, 2]})))
+
+    def test_generate_of_static_template(self):
+        self.assertEqual(['just text'], list(Template('just text').generate()))
+
+
+class AsyncRenderTest(unittest.TestCase):
+    def test_deeply_nested_blocks_await_loop_variables_once(self):
+        async def value(number):
+            return number
+
+        source = '{% for x in items %}' + '{% if a %}' * 30 + '{{ x }}' + '{% endif %}' * 30 + '{{ x }}{% endfor %}'
+        self.assertEqual('1122', asyncio.run(Template(source, cache=None).render_async(a=True, items=[value(1), value(2)])))
+
+    def test_awaitable_variables_are_awaited(self):
+        async def get_name():
+            return 'World'
+
+        template = Template('Hello {{ name }}! {{ name }}!')
+        self.assertEqual('Hello World! World!', asyncio.run(template.render_async(name=get_name())))
+
+    def test_coroutine_results_of_calls_are_awaited(self):
+        async def double(value):
+            return value * 2
+
+        template = Template('{{ double(21) }}')
+        self.assertEqual('42', asyncio.run(template.render_async(double=double)))
+
+    def test_can_loop_over_async_iterables(self):
+        async def numbers():
+            for i in range(3):
+                yield i
+
+        template = Template('{% for i in numbers %}{{ i }}{% endfor %}')
+        self.assertEqual('012', asyncio.run(template.render_async(numbers=numbers())))
+
+    def test_values_used_unconditionally_are_awaited_concurrently(self):
+        async def slow(value):
+            await asyncio.sleep(0.1)
+            return value
+
+        template = Template('{{ a }}{{ b }}{{ c }}')
+        start = time.monotonic()
+        self.assertEqual('123', asyncio.run(template.render_async(a=slow(1), b=slow(2), c=slow(3))))
+        self.assertLess(time.monotonic() - start, 0.25)
+
+    def test_values_of_branches_not_taken_are_not_awaited(self):
+        awaited = []
+
+        class Data(object):
+            def __await__(self):
+                awaited.append(True)
+                yield from asyncio.sleep(0).__await__()
+                return 'data'
+
+        template = Template('{% if show %}{{ data }}{% endif %}')
+        self.assertEqual('', asyncio.run(template.render_async(show=False, data=Data())))
+        self.assertEqual([], awaited)
+        self.assertEqual('data', asyncio.run(template.render_async(show=True, data=Data())))
+
+
+if __name__ == '__main__':
+    unittest.main()
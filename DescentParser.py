@@ -0,0 +1,120 @@
+import Node
+from Parser import Parser, _compare_operators
+
+
+class DescentParser(Parser):
+    """ The recursive descent expression parser, one method per precedence level.
+
+    Parser replaced it; the tests check that both build the same trees, and
+    Benchmark.py compares their speed.
+    """
+
+    def parse_expression(self, with_conditional_expression=True):
+        if with_conditional_expression:
+            return self.parse_conditional_expression()
+        return self.parse_or()
+
+    def parse_conditional_expression(self):
+        expr = self.parse_or()
+        while self.stream.skip_if('name:if'):
+            condition = self.parse_or()
+            if self.stream.skip_if('name:else'):
+                else_expr = self.parse_expression()
+            else:
+                else_expr = None
+            expr = Node.Cond(condition, expr, else_expr)
+        return expr
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.stream.skip_if('name:or'):
+            right = self.parse_and()
+            left = Node.Or(left, right)
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.stream.skip_if('name:and'):
+            right = self.parse_not()
+            left = Node.And(left, right)
+        return left
+
+    def parse_not(self):
+        if self.stream.skip_if('name:not'):
+            return Node.Not(self.parse_not())
+        return self.parse_compare()
+
+    def parse_compare(self):
+        left = self.parse_add()
+        ops = []
+        while True:
+            token_type = self.stream.current.token_type
+            if token_type in _compare_operators:
+                next(self.stream)
+                ops.append(Node.Operand(token_type, self.parse_and()))
+            elif self.stream.skip_if('name:in'):
+                ops.append(Node.Operand('in', self.parse_add()))
+            elif self.stream.current.test('name:not') and self.stream.look().test('name:in'):
+                self.stream.skip(2)
+                ops.append(Node.Operand('notin', self.parse_add()))
+            else:
+                break
+        if not ops:
+            return left
+        return Node.Compare(left, ops)
+
+    def parse_add(self):
+        left = self.parse_sub()
+        while self.stream.current.token_type == 'add':
+            next(self.stream)
+            right = self.parse_sub()
+            left = Node.Add(left, right)
+        return left
+
+    def parse_sub(self):
+        left = self.parse_mul()
+        while self.stream.current.token_type == 'sub':
+            next(self.stream)
+            right = self.parse_mul()
+            left = Node.Sub(left, right)
+        return left
+
+    def parse_mul(self):
+        left = self.parse_div()
+        while self.stream.current.token_type == 'mul':
+            next(self.stream)
+            right = self.parse_div()
+            left = Node.Mul(left, right)
+        return left
+
+    def parse_div(self):
+        left = self.parse_floor_div()
+        while self.stream.current.token_type == 'div':
+            next(self.stream)
+            right = self.parse_floor_div()
+            left = Node.Div(left, right)
+        return left
+
+    def parse_floor_div(self):
+        left = self.parse_mod()
+        while self.stream.current.token_type == 'floordiv':
+            next(self.stream)
+            right = self.parse_mod()
+            left = Node.FloorDiv(left, right)
+        return left
+
+    def parse_mod(self):
+        left = self.parse_pow()
+        while self.stream.current.token_type == 'mod':
+            next(self.stream)
+            right = self.parse_pow()
+            left = Node.Mod(left, right)
+        return left
+
+    def parse_pow(self):
+        left = self.parse_unary()
+        while self.stream.current.token_type == 'pow':
+            next(self.stream)
+            right = self.parse_unary()
+            left = Node.Pow(left, right)
+        return left
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import threading
+import time
+from types import MappingProxyType
+from Exception import TemplateNotFoundException
+import Node
+from Template import Template
+import TemplateCache
+
+# Names of missing templates remembered at most, so that lookups of random names cannot grow memory without bound
+DEFAULT_MAX_MISSING = 1000
+
+
+class Environment(object):
+    """ Loads templates by name through a loader and keeps the compiled ones.
+
+    With auto_reload, a cached template's uptodate() check (a stat for files)
+    runs at most once every reload_interval seconds. Names the loader could
+    not find are remembered for the same interval, so repeated lookups of a
+    missing template do not reach the loader either; at most max_missing
+    names are remembered, the oldest forgotten first. limits bound the
+    parsing of each template (see Parser).
+
+    globals is a read-only view of the builtins and of the names registered
+    with add_globals(), which every template of the environment sees
+    without them being passed to render(). Variables of a render shadow them.
+    """
+
+    def __init__(self, loader=None, auto_reload=True, reload_interval=2.0,
+                 bytecode_cache=None, cache=TemplateCache.default_cache, limits=None, globals=None,
+                 max_missing=DEFAULT_MAX_MISSING):
+        self.loader = loader
+        self.auto_reload = auto_reload
+        self.reload_interval = reload_interval
+        self.bytecode_cache = bytecode_cache
+        self.cache = cache
+        self.limits = limits
+        self._globals = dict(Node.builtins)
+        self._globals.update(globals or ())
+        self.globals = MappingProxyType(self._globals)
+        # name -> [template, uptodate, time of the last uptodate() check]
+        self._templates = {}
+        # name -> time at which the loader failed to find it, the oldest first
+        self._missing = OrderedDict()
+        self.max_missing = max_missing
+        self._lock = threading.Lock()
+
+    def from_string(self, source):
+        return Template(source, bytecode_cache=self.bytecode_cache, cache=self.cache, limits=self.limits,
+                        globals=self.globals)
+
+    def add_globals(self, values=(), **kwargs):
+        """ Registers names (from a mapping or keyword arguments, like dict.update) for all templates, loaded or not """
+        with self._lock:
+            self._globals.update(values, **kwargs)
+
+    def get_template(self, name):
+        now = time.monotonic()
+
+        entry = self._templates.get(name)
+        if entry is not None:
+            template, uptodate, last_checked = entry
+            if not self.auto_reload or now - last_checked < self.reload_interval:
+                return template
+            if uptodate():
+                entry[2] = now
+                return template
+
+        missed_at = self._missing.get(name)
+        if missed_at is not None and (not self.auto_reload or now - missed_at < self.reload_interval):
+            raise TemplateNotFoundException(name)
+
+        return self._load_template(name, now)
+
+    def _load_template(self, name, now):
+        if self.loader is None:
+            raise TypeError('no loader for this environment specified')
+
+        try:
+            source, uptodate = self.loader.get_source(name)
+        except TemplateNotFoundException:
+            with self._lock:
+                self._templates.pop(name, None)
+                self._missing.pop(name, None)
+                self._missing[name] = now
+                while len(self._missing) > self.max_missing:
+                    self._missing.popitem(last=False)
+            raise
+
+        template = self.from_string(source)
+        with self._lock:
+            self._templates[name] = [template, uptodate, now]
+            self._missing.pop(name, None)
+        return template
+
+    def clear_cache(self):
+        with self._lock:
+            self._templates.clear()
+            self._missing.clear()
@@ -0,0 +1,93 @@
+import operator
+import os
+import shutil
+import tempfile
+import unittest
+from Environment import Environment
+from Exception import TemplateNotFoundException, TemplateSyntaxException
+from Loader import DictLoader, FileSystemLoader
+
+
+class CountingLoader(DictLoader):
+    def __init__(self, mapping):
+        DictLoader.__init__(self, mapping)
+        self.calls = 0
+
+    def get_source(self, name):
+        self.calls += 1
+        return DictLoader.get_source(self, name)
+
+
+class EnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_template(self, name, source, mtime):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as template_file:
+            template_file.write(source)
+        os.utime(filename, (mtime, mtime))
+
+    def test_can_load_template_from_file_system(self):
+        self.write_template('hello.html', 'Hello {{ name }}!', 1000)
+        environment = Environment(FileSystemLoader(self.directory))
+        self.assertEqual('Hello World!', environment.get_template('hello.html').render(name='World'))
+
+    def test_templates_are_cached_by_name(self):
+        environment = Environment(CountingLoader({'a': '{{ foo }}'}))
+        self.assertIs(environment.get_template('a'), environment.get_template('a'))
+        self.assertEqual(1, environment.loader.calls)
+
+    def test_modified_file_is_reloaded_after_interval(self):
+        self.write_template('page.html', 'old', 1000)
+        environment = Environment(FileSystemLoader(self.directory), reload_interval=0)
+        self.assertEqual('old', environment.get_template('page.html').render())
+
+        self.write_template('page.html', 'new', 2000)
+        self.assertEqual('new', environment.get_template('page.html').render())
+
+    def test_modified_file_is_not_checked_within_interval(self):
+        self.write_template('page.html', 'old', 1000)
+        environment = Environment(FileSystemLoader(self.directory), reload_interval=3600)
+        environment.get_template('page.html')
+
+        self.write_template('page.html', 'new', 2000)
+        self.assertEqual('old', environment.get_template('page.html').render())
+
+    def test_missing_templates_are_remembered(self):
+        environment = Environment(CountingLoader({}), reload_interval=3600)
+        for _ in range(3):
+            self.assertRaises(TemplateNotFoundException, environment.get_template, 'missing')
+        self.assertEqual(1, environment.loader.calls)
+
+    def test_remembered_missing_names_are_bounded(self):
+        environment = Environment(CountingLoader({}), reload_interval=3600, max_missing=2)
+        for name in ('a', 'b', 'c', 'b'):
+            self.assertRaises(TemplateNotFoundException, environment.get_template, name)
+        self.assertEqual(['b', 'c'], list(environment._missing))
+        self.assertRaises(TemplateNotFoundException, environment.get_template, 'a')
+        self.assertEqual(4, environment.loader.calls)
+
+    def test_names_cannot_escape_search_path(self):
+        environment = Environment(FileSystemLoader(self.directory))
+        self.assertRaises(TemplateNotFoundException, environment.get_template, '../etc/passwd')
+
+    def test_globals_are_registered_once_for_all_templates(self):
+        environment = Environment(DictLoader({'a.html': '{{ site }}/{{ length(name) }}'}), globals={'site': 'x'})
+        template = environment.get_template('a.html')
+        environment.add_globals(site='y')
+        self.assertEqual('y/3', template.render(name='bob'))
+        self.assertEqual('z/3', template.render(name='bob', site='z'))
+        self.assertRaises(TypeError, operator.setitem, environment.globals, 'site', 'w')
+
+    def test_templates_are_parsed_within_limits(self):
+        environment = Environment(DictLoader({'deep.html': '{% if a %}{% if b %}x{% endif %}{% endif %}'}),
+                                  cache=None, limits={'max_depth': 1})
+        self.assertRaises(TemplateSyntaxException, environment.get_template, 'deep.html')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,6 @@
+from LineIndex import LineIndex
+
+
 class TokenException(Exception):
     pass
 
@@ -12,10 +15,23 @@ class TemplateContextException(TokenException):
 
 
 class TemplateSyntaxException(TokenException):
-    def __init__(self, syntax_error_text):
+    def __init__(self, syntax_error_text, position=None):
         self.syntax_error_text = syntax_error_text
+        # Offset of the error in the source; line and column are set by locate()
+        self.position = position
+        self.lineno = None
+        self.column = None
+
+    def locate(self, source):
+        # Without the source (a template tokenized from a file), only the offset is known
+        if self.position is not None and self.lineno is None and source is not None:
+            self.lineno, self.column = LineIndex(source).line_and_column(self.position)
 
     def __str__(self):
+        if self.lineno is not None:
+            return '%s (line %d, column %d)' % (self.syntax_error_text, self.lineno, self.column)
+        elif self.position is not None:
+            return '%s (at offset %d)' % (self.syntax_error_text, self.position)
         return self.syntax_error_text
 
 
@@ -29,4 +45,12 @@ class TemplateParsingException(TokenException):
         self.message = message
 
     def __repr__(self):
-        return self.message
\ No newline at end of file
+        return self.message
+
+
+class TemplateNotFoundException(TokenException):
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return "Template '%s' was not found" % self.name
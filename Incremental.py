@@ -0,0 +1,95 @@
+from bisect import bisect_right
+from Constants import *
+from Lexer import ArrayTokenStream, Tokenizer
+import Node
+from Parser import Parser
+
+# The tokens a Tokenizer produces at root state, where a top-level item can start
+_root_token_types = frozenset([TOKEN_DATA, TOKEN_VARIABLE_START, TOKEN_BLOCK_START])
+
+
+class Item(object):
+    """ A top-level item of a template: static text, a variable or a whole statement """
+
+    __slots__ = ('start', 'tokens', 'nodes')
+
+    def __init__(self, start, tokens, nodes):
+        self.start = start
+        self.tokens = tokens
+        self.nodes = nodes
+
+
+class IncrementalParser(object):
+    """ Keeps the tokens and the tree of a template, so that an edit re-lexes and re-parses only what it touches.
+
+    edit() re-lexes from the start of the top-level item before the edited
+    range, and stops as soon as the lexer is back, at root state, at the start
+    of an item after it. Only the items in between are parsed again; the
+    others keep their tokens and nodes. Templates returned by edit() share
+    those nodes: copy one (copy.deepcopy) before changing it, e.g. with the
+    Optimizer.
+    """
+
+    def __init__(self, lexer, source):
+        self.lexer = lexer
+        self.source = ''
+        self.items = []
+        self.template = None
+        self.edit(0, 0, source)
+
+    @property
+    def tokens(self):
+        return [token for item in self.items for token in item.tokens]
+
+    def edit(self, start, end, text):
+        """ Replaces source[start:end] by text and returns the new tree.
+
+        On a syntax error the exception is raised and the parser keeps the previous source.
+        """
+        source = self.source[:start] + text + self.source[end:]
+        delta = len(text) - (end - start)
+        items = self.items
+
+        # Text inserted right after the previous item may be part of it: re-lexing starts with that item
+        first = max(bisect_right([item.start for item in items], start - 1) - 1, 0)
+        # Static text ends where a tag starts, so text before the first item may grow: it is lexed again too
+        if first > 0 and items[first - 1].tokens[0].token_type == TOKEN_DATA:
+            first -= 1
+        position = items[first].start if items else 0
+        # The items left untouched by the edit, by their start in the new source
+        following = dict((item.start + delta, index) for index, item in enumerate(items) if item.start >= end)
+
+        tokenizer = Tokenizer(self.lexer.rules, self.lexer.tag_starts, source, position)
+        raw_tokens = []
+        for raw_token in tokenizer.tokenize_source():
+            token_type, _, offset = raw_token
+            if offset in following and token_type in _root_token_types and not tokenizer.balancing_stack:
+                # From here on the tokens are those of the untouched items. The items before
+                # never contained an unmatched end tag, so if the new tokens are not whole
+                # statements, no later token can close them: the error is raised right away.
+                new_items = self.parse_items(source, raw_tokens, offset)
+                unchanged_items = items[following[offset]:]
+                if delta:
+                    for item in unchanged_items:
+                        item.start += delta
+                        for token in item.tokens:
+                            token.position += delta
+                return self.update(source, items[:first] + new_items + unchanged_items)
+            raw_tokens.append(raw_token)
+
+        return self.update(source, items[:first] + self.parse_items(source, raw_tokens, len(source)))
+
+    def parse_items(self, source, raw_tokens, end):
+        """ Parses the tokens of the text between raw_tokens[0] and end into items """
+        tokens = list(self.lexer.make_tokens(raw_tokens))
+        offsets = [offset for token_type, _, offset in raw_tokens if token_type != TOKEN_WHITESPACE]
+        offsets.append(end)
+
+        parser = Parser(self.lexer, source, ArrayTokenStream(tokens, end))
+        return [Item(offsets[first], tokens[first:last], nodes) for first, last, nodes in parser.parse_items()]
+
+    def update(self, source, items):
+        self.source = source
+        self.items = items
+        self.template = Node.Template([node for item in items for node in item.nodes])
+        return self.template
@@ -0,0 +1,93 @@
+import random
+import unittest
+from Lexer import Lexer
+from Parser import Parser
+from Incremental import IncrementalParser
+from Exception import TemplateSyntaxException
+
+
+class IncrementalParserTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer()
+        self.source = 'hello {{ name }}!\n{% for i in items %}{{ i }}{% endfor %}\n{% if x %}yes{% endif %}'
+        self.parser = IncrementalParser(self.lexer, self.source)
+
+    def assert_edit_matches_full_parse(self, start, end, text):
+        source = self.source[:start] + text + self.source[end:]
+        template = self.parser.edit(start, end, text)
+        self.source = source
+
+        self.assertEqual(source, self.parser.source)
+        self.assertEqual(repr(Parser(self.lexer, source).parse()), repr(template))
+        self.assertListEqual([token.items() + (token.position, ) for token in self.lexer.tokenize(source)],
+                             [token.items() + (token.position, ) for token in self.parser.tokens])
+
+    def test_parses_like_parser(self):
+        self.assertEqual(repr(Parser(self.lexer, self.source).parse()), repr(self.parser.template))
+
+    def test_can_edit_static_text(self):
+        self.assert_edit_matches_full_parse(0, 5, 'goodbye')
+
+    def test_can_edit_variable(self):
+        start = self.source.index('name')
+        self.assert_edit_matches_full_parse(start, start + 4, 'user.name')
+
+    def test_can_edit_statement_body(self):
+        start = self.source.index('{{ i }}')
+        self.assert_edit_matches_full_parse(start, start, '<li>')
+
+    def test_can_append(self):
+        self.assert_edit_matches_full_parse(len(self.source), len(self.source), ' {{ footer }}')
+
+    def test_can_create_a_tag_from_static_text(self):
+        start = self.source.index('!')
+        self.assert_edit_matches_full_parse(start, start + 1, '{{ 1 }}')
+
+    def test_can_break_a_tag_into_static_text(self):
+        start = self.source.index('{{ name')
+        self.assert_edit_matches_full_parse(start + 1, start + 2, '')
+
+    def test_can_replace_several_items(self):
+        end = self.source.index('{% endfor %}')
+        self.assert_edit_matches_full_parse(0, end, '{% if y %}{{ z }}{% endif %}{% for i in items %}')
+
+    def test_reuses_nodes_of_untouched_items(self):
+        loop = self.parser.template.body[3]
+        self.parser.edit(0, 5, 'goodbye')
+        self.assertIs(loop, self.parser.template.body[3])
+
+    def test_tokens_of_untouched_items_move_with_the_edit(self):
+        parser = IncrementalParser(self.lexer, 'ab{{ x }}')
+        parser.edit(0, 0, 'XXXX')
+        self.assertEqual([0, 6, 9, 11], [token.position for token in parser.tokens])
+
+    def test_random_edits(self):
+        generator = random.Random(17)
+        snippets = ['', 'text', '{{ a }}', '{% if x %}', '{% endif %}', '{{', '}}', ' ', '\n', 'b.c', '(']
+        for _ in range(300):
+            start = generator.randint(0, len(self.source))
+            end = generator.randint(start, min(start + 12, len(self.source)))
+            text = generator.choice(snippets)
+            source = self.source[:start] + text + self.source[end:]
+            try:
+                Parser(self.lexer, source).parse()
+            except Exception:
+                self.assertRaises(Exception, self.parser.edit, start, end, text)
+                continue
+            self.parser.edit(start, end, text)
+            self.source = source
+            self.assertEqual([token.position for token in self.lexer.tokenize_all(self.source).tokens[:-1]],
+                             [token.position for token in self.parser.tokens])
+            self.assertEqual(repr(Parser(self.lexer, self.source).parse()), repr(self.parser.template))
+
+    def test_syntax_error_keeps_previous_source(self):
+        template = self.parser.template
+        start = self.source.index('name')
+        self.assertRaises(TemplateSyntaxException, self.parser.edit, start, start, '(')
+        self.assertEqual(self.source, self.parser.source)
+        self.assertIs(template, self.parser.template)
+        self.assert_edit_matches_full_parse(start, start + 4, 'other')
+
+
+if __name__ == '__main__':
+    unittest.main()
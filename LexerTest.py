@@ -1,5 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import mmap
+import os
+import tempfile
 import unittest
-from Lexer import Lexer
+from Lexer import Lexer, Token, Tokenizer
 from Constants import *
 from Exception import TemplateSyntaxException
 
@@ -30,6 +35,25 @@ class LexerTest(unittest.TestCase):
         tokens = [(TOKEN_DATA, source)]
         self.assert_tokens_are_correct(tokens, source)
 
+    def test_can_parse_multi_line_text(self):
+        source = 'first line\nsecond line\n\n{{ name }}\nlast line\n'
+        tokens = [
+            (TOKEN_DATA, 'first line\nsecond line\n\n'),
+            (TOKEN_VARIABLE_START, '{{'),
+            (TOKEN_NAME, 'name'),
+            (TOKEN_VARIABLE_END, '}}'),
+            (TOKEN_DATA, '\nlast line\n')
+        ]
+        self.assert_tokens_are_correct(tokens, source)
+
+    def test_can_parse_newline(self):
+        self.assert_tokens_are_correct([(TOKEN_DATA, '\n')], '\n')
+
+    def test_text_with_braces_is_data(self):
+        source = '{ a } %} }} {%'
+        tokens = [(TOKEN_DATA, '{ a } %} }} '), (TOKEN_BLOCK_START, '{%')]
+        self.assert_tokens_are_correct(tokens, source)
+
     def test_can_parse_start_block(self):
         source = '{%'
         tokens = [(TOKEN_BLOCK_START, source)]
@@ -300,6 +324,19 @@ class LexerTest(unittest.TestCase):
         ]
         self.assert_tokens_are_correct(tokens, source)
 
+    def test_can_process_identifiers_mixing_ascii_and_unicode(self):
+        source = '{{ naïve + café_2 + _x }}'
+        tokens = [
+            (TOKEN_VARIABLE_START, '{{'),
+            (TOKEN_NAME, 'naïve'),
+            (TOKEN_ADD, '+'),
+            (TOKEN_NAME, 'café_2'),
+            (TOKEN_ADD, '+'),
+            (TOKEN_NAME, '_x'),
+            (TOKEN_VARIABLE_END, '}}')
+        ]
+        self.assert_tokens_are_correct(tokens, source)
+
     def test_can_use_look(self):
         source = '{{ foo }}'
         stream = self.lexer.tokenize(source)
@@ -329,6 +366,54 @@ class LexerTest(unittest.TestCase):
         stream = self.lexer.tokenize(source)
         self.assert_stream_raises(stream, TemplateSyntaxException)
 
+    def test_tag_end_takes_precedence_over_operators(self):
+        source = '{% 7%2%}{{ "}}" }}'
+        tokens = [
+            (TOKEN_BLOCK_START, '{%'),
+            (TOKEN_INTEGER, 7),
+            (TOKEN_MOD, '%'),
+            (TOKEN_INTEGER, 2),
+            (TOKEN_BLOCK_END, '%}'),
+            (TOKEN_VARIABLE_START, '{{'),
+            (TOKEN_STRING, '}}'),
+            (TOKEN_VARIABLE_END, '}}')
+        ]
+        self.assert_tokens_are_correct(tokens, source)
+
+    def test_lexer_can_be_reused(self):
+        source = '{{ foo }} bar'
+        self.assertListEqual(self.get_tokens(source), self.get_tokens(source))
+
+    def test_lexer_can_be_shared_between_threads(self):
+        sources = ['{%% for i in items%d %%}{{ i + %d }}{%% endfor %%}' % (n, n) for n in range(50)]
+        expected = [self.get_tokens(source) for source in sources]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertListEqual(expected, list(executor.map(self.get_tokens, sources)))
+
+
+class TokenTest(unittest.TestCase):
+    def test_can_test_type(self):
+        token = Token(TOKEN_NAME, 'if')
+        self.assertTrue(token.test(TOKEN_NAME))
+        self.assertFalse(token.test(TOKEN_STRING))
+
+    def test_can_test_type_and_value(self):
+        token = Token(TOKEN_NAME, 'if')
+        self.assertTrue(token.test('name:if'))
+        self.assertFalse(token.test('name:else'))
+        self.assertFalse(token.test('string:if'))
+        self.assertFalse(token.test('name:if:else'))
+
+    def test_can_test_any(self):
+        token = Token(TOKEN_NAME, 'endfor')
+        self.assertTrue(token.test_any('name:endif', 'name:endfor'))
+        self.assertFalse(token.test_any('name:endif', TOKEN_STRING))
+        self.assertFalse(token.test_any())
+
+    def test_has_no_instance_dictionary(self):
+        self.assertFalse(hasattr(Token(TOKEN_NAME, 'if'), '__dict__'))
+
 
 class TokenStream(unittest.TestCase):
     def setUp(self):
@@ -374,5 +459,99 @@ class TokenStream(unittest.TestCase):
         assert not stream
 
 
+class ArrayTokenStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer()
+
+    def test_has_same_tokens_as_token_stream(self):
+        source = 'hello {{ name }} {% for i in [1, 2] %}{{ i }}{% endfor %}'
+        self.assertListEqual([token.items() for token in self.lexer.tokenize(source)],
+                             [token.items() for token in self.lexer.tokenize_all(source)])
+
+    def test_raises_when_created(self):
+        self.assertRaises(TemplateSyntaxException, self.lexer.tokenize_all, '{{ 2 + (4 }}')
+
+    def test_can_look_ahead(self):
+        stream = self.lexer.tokenize_all('{{ foo }}')
+        self.assertTrue(stream.look().test('name:foo'))
+        self.assertTrue(stream.look(2).test(TOKEN_VARIABLE_END))
+        self.assertTrue(stream.look(10).test(TOKEN_EOF))
+        self.assertTrue(stream.current.test(TOKEN_VARIABLE_START))
+
+    def test_can_skip(self):
+        stream = self.lexer.tokenize_all('{{ foo }}')
+        stream.skip(2)
+        stream.expect(TOKEN_VARIABLE_END)
+        self.assertTrue(stream.has_ended())
+        stream.skip(5)
+        self.assertTrue(stream.has_ended())
+
+    def test_can_reset_to_mark(self):
+        stream = self.lexer.tokenize_all('{{ foo.bar }}')
+        next(stream)
+        mark = stream.mark()
+        stream.expect('name:foo')
+        stream.expect(TOKEN_DOT)
+        stream.reset(mark)
+        self.assertTrue(stream.skip_if('name:foo'))
+        self.assertFalse(stream.skip_if(TOKEN_NAME))
+
+    def test_stops_iteration_when_stream_ends(self):
+        stream = self.lexer.tokenize_all('hello {{name}}')
+        self.assertEqual(4, len(list(stream)))
+        self.assertTrue(stream.has_ended())
+        self.assertFalse(stream)
+
+
+class TokenizeFileTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer()
+        self.source = ('<ul>\n{% for item in items %}<li class="{{ "a}}b" }}">{{ item.price * 1.25 }} €</li>\n'
+                       '{% endfor %}</ul>\n{{ naïve ** 2 // 3 }}\n') * 20
+
+    def get_tokens(self, tokens):
+        return [token.items() for token in tokens]
+
+    def test_tokens_are_the_same_for_every_window_size(self):
+        expected = self.get_tokens(self.lexer.tokenize(self.source))
+        for window_size in (1, 2, 3, 7, 64, 4096):
+            stream = self.lexer.tokenize_file(io.BytesIO(self.source.encode('utf-8')), window_size=window_size)
+            self.assertListEqual(expected, self.get_tokens(stream))
+
+    def test_can_tokenize_path_and_mmap(self):
+        expected = self.get_tokens(self.lexer.tokenize(self.source))
+        descriptor, filename = tempfile.mkstemp()
+        try:
+            with os.fdopen(descriptor, 'wb') as template_file:
+                template_file.write(self.source.encode('utf-8'))
+            self.assertListEqual(expected, self.get_tokens(self.lexer.tokenize_file(filename, window_size=100)))
+
+            with open(filename, 'rb') as template_file:
+                with mmap.mmap(template_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    self.assertListEqual(expected, self.get_tokens(self.lexer.tokenize_file(mapped, window_size=100)))
+        finally:
+            os.remove(filename)
+
+    def test_can_tokenize_other_encodings(self):
+        expected = self.get_tokens(self.lexer.tokenize(self.source))
+        stream = self.lexer.tokenize_file(self.source.encode('utf-16'), encoding='utf-16', window_size=5)
+        self.assertListEqual(expected, self.get_tokens(stream))
+
+    def test_long_static_text_is_not_held_back(self):
+        tokenizer = Tokenizer(self.lexer.rules, self.lexer.tag_starts, 'x' * 100 + '{')
+        # Only the '{' that may start a tag waits for the next window
+        self.assertEqual([(TOKEN_DATA, 'x' * 100, 0)], tokenizer.tokenize_window(final=False))
+        self.assertEqual(100, tokenizer.position)
+
+        source = 'x' * 1000 + '{{ a }}' + '{y' * 10 + '{{ b }}{'
+        stream = self.lexer.tokenize_file(source.encode('utf-8'), window_size=10)
+        self.assertListEqual(self.get_tokens(self.lexer.tokenize(source)), self.get_tokens(stream))
+
+    def test_errors_are_raised(self):
+        for source in ('{{ "never closed }}', '{{ (1, 2 }}', '{{ 1 ) }}'):
+            stream = self.lexer.tokenize_file(source.encode('utf-8'), window_size=4)
+            self.assertRaises(TemplateSyntaxException, list, stream)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
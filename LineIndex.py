@@ -0,0 +1,20 @@
+from bisect import bisect_right
+import re
+
+_newline_re = re.compile(r'\r\n|\r|\n')
+
+
+class LineIndex(object):
+    """ Turns offsets in a source into (line, column) pairs, both starting at 1.
+
+    The offsets where lines start are found once, then each lookup is a bisect:
+    tokens only keep their offset, and positions are computed when needed.
+    """
+
+    def __init__(self, source):
+        self.line_starts = [0]
+        self.line_starts.extend(match.end() for match in _newline_re.finditer(source))
+
+    def line_and_column(self, offset):
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
@@ -0,0 +1,61 @@
+import unittest
+from Lexer import Lexer
+from LineIndex import LineIndex
+from Parser import Parser
+from Exception import TemplateSyntaxException
+
+
+class LineIndexTest(unittest.TestCase):
+    def test_first_line(self):
+        index = LineIndex('hello')
+        self.assertEqual((1, 1), index.line_and_column(0))
+        self.assertEqual((1, 5), index.line_and_column(4))
+
+    def test_can_find_lines(self):
+        index = LineIndex('ab\ncd\r\nef\rgh')
+        self.assertEqual((1, 3), index.line_and_column(2))
+        self.assertEqual((2, 1), index.line_and_column(3))
+        self.assertEqual((2, 3), index.line_and_column(5))
+        self.assertEqual((3, 1), index.line_and_column(7))
+        self.assertEqual((4, 2), index.line_and_column(11))
+
+    def test_end_of_source(self):
+        index = LineIndex('ab\n')
+        self.assertEqual((2, 1), index.line_and_column(3))
+
+
+class SyntaxErrorLocationTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer()
+
+    def get_error(self, function, *args):
+        with self.assertRaises(TemplateSyntaxException) as context:
+            function(*args)
+        return context.exception
+
+    def test_tokens_keep_their_offset(self):
+        tokens = list(self.lexer.tokenize('ab\n{{ foo }}'))
+        self.assertListEqual([0, 3, 6, 10], [token.position for token in tokens])
+
+    def test_lexer_errors_have_line_and_column(self):
+        error = self.get_error(list, self.lexer.tokenize('hello\n\n  {{ a ) }}'))
+        self.assertEqual((3, 8), (error.lineno, error.column))
+        self.assertIn('line 3, column 8', str(error))
+
+    def test_parser_errors_have_line_and_column(self):
+        error = self.get_error(lambda: Parser(self.lexer, 'a\n{% for i in %}').parse())
+        self.assertEqual((2, 13), (error.lineno, error.column))
+
+    def test_unexpected_end_of_file_is_at_the_end(self):
+        error = self.get_error(lambda: Parser(self.lexer, '{% if a %}\nb').parse())
+        self.assertEqual((2, 2), (error.lineno, error.column))
+
+    def test_errors_in_windows_have_offset(self):
+        stream = self.lexer.tokenize_file(b'hello\n\n  {{ a ) }}', window_size=3)
+        error = self.get_error(list, stream)
+        self.assertEqual(14, error.position)
+        self.assertIn('at offset 14', str(error))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import importlib.resources
+import os
+from Exception import TemplateNotFoundException
+
+
+def split_template_path(name):
+    """ Splits 'pages/index.html' into its segments, refusing names that escape the search path """
+    pieces = []
+    for piece in name.split('/'):
+        if os.path.sep in piece or (os.path.altsep and os.path.altsep in piece) or piece == os.path.pardir:
+            raise TemplateNotFoundException(name)
+        elif piece and piece != '.':
+            pieces.append(piece)
+    return pieces
+
+
+class BaseLoader(object):
+    """ A loader turns a template name into its source.
+
+    get_source(name) returns (source, uptodate) where uptodate() tells whether
+    the source is still current. It raises TemplateNotFoundException for
+    unknown names.
+    """
+
+    def get_source(self, name):
+        raise TemplateNotFoundException(name)
+
+
+class FileSystemLoader(BaseLoader):
+    def __init__(self, searchpath, encoding='utf-8'):
+        if isinstance(searchpath, str):
+            searchpath = [searchpath]
+        self.searchpath = list(searchpath)
+        self.encoding = encoding
+
+    def get_source(self, name):
+        pieces = split_template_path(name)
+        for directory in self.searchpath:
+            filename = os.path.join(directory, *pieces)
+            try:
+                with open(filename, encoding=self.encoding) as template_file:
+                    mtime = os.fstat(template_file.fileno()).st_mtime
+                    source = template_file.read()
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                continue
+
+            def uptodate():
+                try:
+                    return os.path.getmtime(filename) == mtime
+                except OSError:
+                    return False
+
+            return source, uptodate
+        raise TemplateNotFoundException(name)
+
+
+class DictLoader(BaseLoader):
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def get_source(self, name):
+        if name not in self.mapping:
+            raise TemplateNotFoundException(name)
+        source = self.mapping[name]
+        return source, lambda: self.mapping.get(name) == source
+
+
+class PackageLoader(BaseLoader):
+    """ Loads templates shipped as resources of a package (package_path is the directory inside it) """
+
+    def __init__(self, package_name, package_path='templates', encoding='utf-8'):
+        self.package_name = package_name
+        self.package_path = package_path
+        self.encoding = encoding
+
+    def get_source(self, name):
+        resource = importlib.resources.files(self.package_name).joinpath(self.package_path)
+        for piece in split_template_path(name):
+            resource = resource.joinpath(piece)
+
+        try:
+            source = resource.read_bytes().decode(self.encoding)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise TemplateNotFoundException(name)
+
+        # Resources inside zip files cannot change while the process runs
+        if not isinstance(resource, os.PathLike):
+            return source, lambda: True
+
+        filename = os.fspath(resource)
+        mtime = os.path.getmtime(filename)
+
+        def uptodate():
+            try:
+                return os.path.getmtime(filename) == mtime
+            except OSError:
+                return False
+
+        return source, uptodate
@@ -1,5 +1,6 @@
 import random
 import operator
+from types import MappingProxyType
 
 _binary_operator_to_function = {
     '+': operator.add,
@@ -29,6 +30,40 @@ _compare_operator_to_function = {
 }
 
 
+def even(x):
+    return x % 2 == 0
+
+
+def odd(x):
+    return x % 2 != 0
+
+
+# Built once: every render shares this read-only mapping as the first layer of its Context
+builtins = MappingProxyType({
+    'abs': abs,
+    'any': any,
+    'all': all,
+    'capitalize': str.capitalize,
+    'float': float,
+    'format': format,
+    'int': int,
+    'length': len,
+    'lower': str.lower,
+    'random': random.random,
+    'randint': random.randint,
+    'range': range,
+    'round': round,
+    'reversed': reversed,
+    'sorted': sorted,
+    'string': str,
+    'title': str.title,
+    'upper': str.upper,
+    'even': even,
+    'odd': odd,
+    'type': type
+})
+
+
 def resolve_in_context(name, scope_stack):
     for scope in reversed(scope_stack):
         if name in scope:
@@ -36,6 +71,30 @@ def resolve_in_context(name, scope_stack):
     raise Exception('Variable %s was not found' % name)
 
 
+class Context(list):
+    """ The scope stack of a render, searched from the end by resolve_in_context().
+
+    The first layer holds the globals: the builtins, or those of an
+    environment, which include them. It is read-only and shared by every
+    render. The variables of the render come next, then a scope per loop
+    being rendered, pushed with append() and popped with pop(). Loops of a
+    template analysed by Scope keep their variables in slots instead.
+    """
+
+    __slots__ = ('slots', )
+
+    def __init__(self, globals=builtins, variables=None, slot_count=0):
+        list.__init__(self, (globals, variables if variables is not None else {}))
+        self.slots = [None] * slot_count
+
+
+def build_context(variables=None):
+    """ Returns the Context of a render of variables with the builtins as globals; a Context is returned as is """
+    if isinstance(variables, Context):
+        return variables
+    return Context(builtins, variables)
+
+
 def with_metaclass(meta, *bases):
     # This requires a bit of explanation: the basic idea is to make a
     # dummy metaclass for one level of class instanciation that replaces
@@ -58,10 +117,32 @@ def with_metaclass(meta, *bases):
     return Metaclass('temporary_class', None, {})
 
 
+def _make_init(fields, attributes):
+    """ Source of the __init__ of a concrete node class: fields are unpacked and attributes assigned directly """
+    lines = ['def __init__(self, *fields%s):' % ''.join(', %s=None' % name for name in attributes),
+             '    if fields:',
+             '        if len(fields) != %d:' % len(fields),
+             '            self._check_fields(fields)']
+    if fields:
+        lines.append('        %s, = fields' % ', '.join('self.' + name for name in fields))
+    lines.extend('    self.%s = %s' % (name, name) for name in attributes)
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['__init__']
+
+
 class NodeType(type):
+    """ Collects fields and attributes along the bases, and stores them in __slots__.
+
+    Nodes have no __dict__: a field or attribute that was never set raises
+    AttributeError like before. Concrete classes get a generated __init__
+    unless they define one.
+    """
+
     def __new__(cls, name, bases, dct):
         assert len(bases) == 1, 'Multiple inheritance is not allowed!'
 
+        inherited = getattr(bases[0], 'fields', ()) + getattr(bases[0], 'attributes', ())
         for attr in ['fields', 'attributes']:
             storage = []
             storage.extend(getattr(bases[0], attr, ()))
@@ -69,6 +150,9 @@ class NodeType(type):
             assert len(storage) == len(set(storage))
             dct[attr] = tuple(storage)
         dct.setdefault('abstract', False)
+        dct.setdefault('__slots__', tuple(name for name in dct['fields'] + dct['attributes'] if name not in inherited))
+        if not dct['abstract'] and '__init__' not in dct:
+            dct['__init__'] = _make_init(dct['fields'], dct['attributes'])
         return type.__new__(cls, name, bases, dct)
 
 
@@ -112,44 +196,60 @@ class Node(with_metaclass(NodeType, object)):
                       arg in self.fields)
         )
 
+    def __reduce__(self):
+        # Pickled as the constructor call that builds the node again, which is
+        # smaller and faster to load than the generic __dict__ based protocol
+        fields = tuple(getattr(self, name, None) for name in self.fields)
+        attributes = dict((name, getattr(self, name)) for name in self.attributes
+                          if getattr(self, name, None) is not None)
+        if attributes:
+            return self.__class__, fields, attributes
+        return self.__class__, fields
+
+    def __setstate__(self, attributes):
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+    def iter_fields(self):
+        for name in self.fields:
+            yield name, getattr(self, name, None)
+
+    def iter_child_nodes(self):
+        for _, item in self.iter_fields():
+            if isinstance(item, list):
+                for child in item:
+                    if isinstance(child, Node):
+                        yield child
+            elif isinstance(item, Node):
+                yield item
+
     def render_as_string(self, context=None):
         return str(self.render(context))
 
+    def generate(self, context=None):
+        yield self.render_as_string(context)
+
 
 class Template(Node):
     fields = ('body', )
+    # slot_count: set by Scope.analyze_scopes(), None before
+    attributes = ('slot_count', )
 
     def render(self, context=None):
         context = self._build_context(context)
         return ''.join(item.render_as_string(context) for item in self.body)
 
+    def generate(self, context=None):
+        context = self._build_context(context)
+        for item in self.body:
+            yield from item.generate(context)
+
     def _build_context(self, context):
-        builtin_functions = {'abs': abs,
-                             'any': any,
-                             'all': all,
-                             'capitalize': str.capitalize,
-                             'float': float,
-                             'format': format,
-                             'int': int,
-                             'length': len,
-                             'lower': str.lower,
-                             'random': random.random,
-                             'randint': random.randint,
-                             'range': range,
-                             'round': round,
-                             'reversed': reversed,
-                             'sorted': sorted,
-                             'string': str,
-                             'title': str.title,
-                             'upper': str.upper,
-                             'even': lambda x: x % 2 == 0,
-                             'odd': lambda x: x % 2 != 0,
-                             'type': type
-        }
-        if context is not None:
-            return [builtin_functions, context]
-        else:
-            return [builtin_functions]
+        if not isinstance(context, Context):
+            return Context(builtins, context, self.slot_count or 0)
+        if self.slot_count and len(context.slots) < self.slot_count:
+            context.slots = [None] * self.slot_count
+        return context
 
 ###########################################################################
 #                                                                         #
@@ -167,8 +267,12 @@ class Value(Node):
 
 class Variable(Node):
     fields = ('name', )
+    # slot: of the loop binding the name, None for the other variables (see Scope)
+    attributes = ('slot', )
 
     def render(self, context=None):
+        if self.slot is not None:
+            return context.slots[self.slot]
         return resolve_in_context(self.name, context)
 
 ###########################################################################
@@ -253,6 +357,11 @@ class If(Node):
         else:
             return ''
 
+    def generate(self, context=None):
+        body = self.body if self.test.render(context) else self.else_body
+        for item in body or ():
+            yield from item.generate(context)
+
 
 class Cond(Node):
     """ Render a if-else statement:
@@ -275,9 +384,18 @@ class Cond(Node):
 
 class For(Node):
     fields = ('target', 'items', 'body')
+    # slot: where the item is stored, in an analysed template; otherwise each item is pushed in a new scope
+    attributes = ('slot', )
 
     def render(self, context=None):
         result = []
+        if self.slot is not None:
+            slots = context.slots
+            for item in self.items.render(context):
+                slots[self.slot] = item
+                result.extend(expr.render_as_string(context) for expr in self.body)
+            return ''.join(result)
+
         for item in self.items.render(context):
             context.append({self.target.render(context): item})
             result.extend(expr.render_as_string(context) for expr in self.body)
@@ -285,6 +403,21 @@ class For(Node):
 
         return ''.join(result)
 
+    def generate(self, context=None):
+        if self.slot is not None:
+            slots = context.slots
+            for item in self.items.render(context):
+                slots[self.slot] = item
+                for expr in self.body:
+                    yield from expr.generate(context)
+            return
+
+        for item in self.items.render(context):
+            context.append({self.target.render(context): item})
+            for expr in self.body:
+                yield from expr.generate(context)
+            context.pop()
+
 
 ###########################################################################
 #                                                                         #
@@ -0,0 +1,61 @@
+import copy
+import operator
+import pickle
+import unittest
+import Node
+
+
+class NodeTest(unittest.TestCase):
+    def test_fields_and_attributes_are_slots(self):
+        node = Node.If(Node.Variable('a'), [], [])
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIsNone(node.environment)
+        self.assertRaises(AttributeError, setattr, node, 'unknown', 1)
+
+    def test_fields_are_set_in_order(self):
+        node = Node.For(Node.Value('i'), Node.Variable('items'), [], environment='env')
+        self.assertEqual([('target', node.target), ('items', node.items), ('body', [])], list(node.iter_fields()))
+        self.assertEqual('env', node.environment)
+
+    def test_fields_may_be_left_unset(self):
+        node = Node.If()
+        self.assertRaises(AttributeError, getattr, node, 'test')
+        node.test = Node.Value(True)
+        self.assertEqual('If(test=Value(value=True), body=None, else_body=None)', repr(node))
+
+    def test_wrong_number_of_fields(self):
+        self.assertRaises(TypeError, Node.If, Node.Value(True))
+        self.assertRaises(TypeError, Node.Template, [], [])
+
+    def test_abstract_nodes_cannot_be_created(self):
+        self.assertRaises(TypeError, Node.BinaryExpr, Node.Value(1), Node.Value(2))
+
+    def test_can_pickle_and_copy(self):
+        node = Node.Add(Node.Value(1), Node.Variable('a'), environment='env')
+        for clone in [pickle.loads(pickle.dumps(node)), copy.deepcopy(node)]:
+            self.assertEqual(repr(node), repr(clone))
+            self.assertEqual('env', clone.environment)
+
+
+class ContextTest(unittest.TestCase):
+    def test_builtins_are_shared_and_read_only(self):
+        self.assertIs(Node.build_context({})[0], Node.build_context(None)[0])
+        self.assertRaises(TypeError, operator.setitem, Node.builtins, 'upper', None)
+
+    def test_layers_are_searched_from_the_end(self):
+        context = Node.Context(Node.builtins, {'length': 'mine', 'a': 1})
+        context.append({'a': 2})
+        self.assertEqual(2, Node.resolve_in_context('a', context))
+        self.assertEqual('mine', Node.resolve_in_context('length', context))
+        self.assertIs(abs, Node.resolve_in_context('abs', context))
+        context.pop()
+        self.assertEqual(1, Node.resolve_in_context('a', context))
+
+    def test_build_context_keeps_a_context(self):
+        context = Node.Context(Node.builtins, {'a': 1})
+        self.assertIs(context, Node.build_context(context))
+        self.assertEqual({}, Node.build_context()[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import math
+import Node
+from Parser import NodeTransformer
+
+# Folding must not build huge strings or numbers at compile time ('a' * 10 ** 9)
+_max_folded_length = 4096
+
+
+def is_constant(node):
+    return isinstance(node, Node.Value)
+
+
+def is_foldable_value(value):
+    """ Only values the code generator can write back as literals are folded """
+    if value is None or isinstance(value, (bool, float)):
+        return True
+    elif isinstance(value, int):
+        return value.bit_length() <= _max_folded_length
+    elif isinstance(value, str):
+        return len(value) <= _max_folded_length
+    elif isinstance(value, tuple):
+        return len(value) <= _max_folded_length and all(is_foldable_value(item) for item in value)
+    return False
+
+
+class Optimizer(NodeTransformer):
+    """ Simplifies a parsed template so that less is left to do at render time.
+
+    * 2 + 3, not True, 1 < 2 and (1, 2) become Value nodes
+    * x in [1, 2, 3] tests against a constant tuple instead of building a list
+    * if-statements with a constant test are replaced by the branch that is taken
+    * adjacent static text in a body is merged into one Value
+    Lists and dicts are never folded: they are mutable and are rebuilt on every render.
+    Calls are never evaluated: a builtin can be shadowed by a variable of the render.
+    """
+
+    def coalesce(self, body):
+        """ Merges adjacent Value nodes of a body into a single Value holding their text """
+        result = []
+        for item in body:
+            if is_constant(item):
+                text = str(item.value)
+                if not text:
+                    continue
+                if result and is_constant(result[-1]):
+                    result[-1] = Node.Value(result[-1].value + text)
+                    continue
+                item = Node.Value(text)
+            result.append(item)
+        body[:] = result
+
+    def visit_Template(self, node):
+        self.generic_visit(node)
+        self.coalesce(node.body)
+        return node
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        if is_constant(node.test):
+            # The parent body splices the taken branch in place of the if-statement
+            return node.body if node.test.value else (node.else_body or [])
+        self.coalesce(node.body)
+        if node.else_body:
+            self.coalesce(node.else_body)
+        return node
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        if is_constant(node.items) and node.items.value in ((), ''):
+            return []
+        self.coalesce(node.body)
+        return node
+
+    def fold(self, node):
+        """ Evaluates a node whose children are all constants, keeping it when that fails """
+        try:
+            value = node.render([])
+        except Exception:
+            return node
+        if not is_foldable_value(value):
+            return node
+        return Node.Value(value)
+
+    def visit_BinaryExpr(self, node):
+        self.generic_visit(node)
+        if is_constant(node.left) and is_constant(node.right):
+            if not self.is_small_operation(node, node.left.value, node.right.value):
+                return node
+            return self.fold(node)
+        return node
+
+    visit_Add = visit_Sub = visit_Mul = visit_Div = visit_BinaryExpr
+    visit_FloorDiv = visit_Mod = visit_Pow = visit_BinaryExpr
+
+    def is_small_operation(self, node, left, right):
+        if isinstance(node, Node.Mul):
+            for sequence, count in ((left, right), (right, left)):
+                if isinstance(sequence, (str, tuple)) and isinstance(count, int):
+                    return len(sequence) * count <= _max_folded_length
+        elif isinstance(node, Node.Mod) and isinstance(left, str):
+            # Width and precision fields ('%0*d' % (10 ** 8, 1)) make the size of a formatted string unbounded
+            return False
+        elif isinstance(node, Node.Pow) and isinstance(right, (int, float)) and isinstance(left, (int, float)):
+            if abs(left) > 1 and right > 0:
+                return right * math.log2(abs(left)) <= _max_folded_length
+        return True
+
+    def visit_And(self, node):
+        self.generic_visit(node)
+        if is_constant(node.left):
+            return node.right if node.left.value else node.left
+        return node
+
+    def visit_Or(self, node):
+        self.generic_visit(node)
+        if is_constant(node.left):
+            return node.left if node.left.value else node.right
+        return node
+
+    def visit_UnaryExpr(self, node):
+        self.generic_visit(node)
+        if is_constant(node.node):
+            return self.fold(node)
+        return node
+
+    visit_Not = visit_Neg = visit_Pos = visit_UnaryExpr
+
+    def visit_Cond(self, node):
+        self.generic_visit(node)
+        if not is_constant(node.test):
+            return node
+
+        # The branches of a Cond are rendered as strings
+        branch = node.if_expr if node.test.value else node.else_expr
+        if is_constant(branch):
+            return Node.Value(str(branch.value))
+        return node
+
+    def visit_Tuple(self, node):
+        self.generic_visit(node)
+        if all(is_constant(item) for item in node.items):
+            return self.fold(node)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        for op in node.ops:
+            if op.operator in ('in', 'notin'):
+                op.expr = self.make_membership_tuple(op.expr)
+
+        if is_constant(node.expr) and all(is_constant(op.expr) for op in node.ops):
+            return self.fold(node)
+        return node
+
+    def make_membership_tuple(self, node):
+        """ [1, 2, 3] on the right of 'in' becomes a constant tuple.
+
+        Not a frozenset: a tuple compares items like the list does, so an
+        unhashable left operand ([1] in [1, 2]) is still tested instead of raising.
+        """
+        if isinstance(node, Node.List) and all(is_constant(item) for item in node.items):
+            return Node.Value(tuple(item.value for item in node.items))
+        return node
+
+
+def optimize(node):
+    return Optimizer().visit(node)
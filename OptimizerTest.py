@@ -0,0 +1,103 @@
+import unittest
+from Lexer import Lexer
+from Parser import Parser
+from Optimizer import optimize
+import Compiler
+import Node
+import ParserTest
+
+
+def parse(source):
+    return optimize(Parser(Lexer(), source).parse())
+
+
+class OptimizedTemplatesRenderTest(ParserTest.ParserTest):
+    """ Runs every parser test again on optimized trees, through both renderers """
+
+    def parse(self, source):
+        return parse(source)
+
+    def render_outputs(self, parsed_source):
+        return [parsed_source.render(self.items), Compiler.load(Compiler.compile_template(parsed_source))['render'](self.items)]
+
+
+class OptimizerTest(unittest.TestCase):
+    def get_expression(self, source):
+        return optimize(Parser(Lexer(), source).parse().body[0])
+
+    def assert_folds_to(self, source, value):
+        node = self.get_expression(source)
+        self.assertIsInstance(node, Node.Value)
+        self.assertEqual(value, node.value)
+
+    def test_folds_arithmetic(self):
+        self.assert_folds_to('{{ 2 + 3 * 4 }}', 14)
+        self.assert_folds_to('{{ -(7 // 2) }}', -3)
+
+    def test_folds_boolean_operators(self):
+        self.assert_folds_to('{{ not True }}', False)
+        self.assert_folds_to('{{ 1 < 2 }}', True)
+        self.assert_folds_to('{{ False or "x" }}', 'x')
+
+    def test_builtin_calls_can_be_shadowed(self):
+        self.assertIsInstance(self.get_expression('{{ upper("abc") }}'), Node.Call)
+        render = Compiler.load(Compiler.compile_template(parse('{{ upper("abc") }}')))['render']
+        self.assertEqual('ABC', render({}))
+        self.assertEqual('mine', render({'upper': lambda value: 'mine'}))
+
+    def test_keeps_expressions_depending_on_context(self):
+        self.assertIsInstance(self.get_expression('{{ foo + 1 }}'), Node.Add)
+        self.assertIsInstance(self.get_expression('{{ True and foo }}'), Node.Variable)
+
+    def test_keeps_expressions_that_fail(self):
+        self.assertIsInstance(self.get_expression('{{ 1 / 0 }}'), Node.Div)
+
+    def test_does_not_build_huge_constants(self):
+        self.assertIsInstance(self.get_expression('{{ "a" * 1000000000 }}'), Node.Mul)
+        self.assertIsInstance(self.get_expression('{{ 10 ** 1000000 }}'), Node.Pow)
+        self.assertIsInstance(self.get_expression('{{ "%0*d" % (100000000, 1) }}'), Node.Mod)
+        self.assertIsInstance(self.get_expression('{{ "%.100000000f" % 1.5 }}'), Node.Mod)
+        self.assert_folds_to('{{ 7 % 3 }}', 1)
+
+    def test_does_not_fold_mutable_lists(self):
+        self.assertIsInstance(self.get_expression('{{ [1, 2] }}'), Node.List)
+
+    def test_membership_in_literal_list_uses_tuple(self):
+        compare = self.get_expression('{{ foo in [1, 2, 3] }}')
+        self.assertEqual((1, 2, 3), compare.ops[0].expr.value)
+
+    def test_membership_of_unhashable_values(self):
+        for source in ['{{ foo in [1, 2] }}', '{{ foo not in [[1], 2] }}', '{{ foo in ([1], 2) }}']:
+            for foo in ([1], {}, slice(1)):
+                expected = Parser(Lexer(), source).parse().render({'foo': foo})
+                parsed_source = parse(source)
+                render = Compiler.load(Compiler.compile_template(parsed_source))['render']
+                self.assertEqual(expected, parsed_source.render({'foo': foo}), source)
+                self.assertEqual(expected, render({'foo': foo}), source)
+
+    def test_adjacent_text_is_merged(self):
+        template = parse('Hello {{ "World" }}{{ 1 + 1 }}!{{ foo }}')
+        self.assertEqual(2, len(template.body))
+        self.assertEqual('Hello World2!', template.body[0].value)
+
+    def test_constant_if_is_replaced_by_its_branch(self):
+        template = parse('a{% if 1 > 2 %}b{% elif True %}c{% else %}d{% endif %}e')
+        self.assertEqual(1, len(template.body))
+        self.assertEqual('ace', template.body[0].value)
+
+    def test_if_with_dynamic_test_is_kept(self):
+        template = parse('{% if foo %}b{{ "c" }}{% endif %}')
+        self.assertIsInstance(template.body[0], Node.If)
+        self.assertEqual('bc', template.body[0].body[0].value)
+
+    def test_static_template_renders_precomputed_string(self):
+        namespace = Compiler.load(Compiler.compile_template(parse('{% if True %}x{{ 2 * 3 }}{% endif %}')))
+        self.assertEqual('x6', namespace['static_output'])
+        self.assertEqual('x6', namespace['render']({}))
+
+        namespace = Compiler.load(Compiler.compile_template(parse('{{ foo }}')))
+        self.assertIsNone(namespace['static_output'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,8 +9,34 @@ def ensure(expr):
 
 
 _statement_keywords = ['for', 'if']
+_if_end_tokens = ('name:elif', 'name:else', 'name:endif')
+_else_end_tokens = ('name:endif', )
+_for_end_tokens = ('name:endfor', )
 _compare_operators = frozenset(['eq', 'ne', 'lt', 'lteq', 'gt', 'gteq'])
 
+# Precedence levels of the expression grammar, from the loosest. Unary + and - bind tighter than all of them.
+# The right operand of a comparison is parsed at the level of 'and', that of 'in' at the level of '+'.
+_or_precedence = 1
+_and_precedence = 2
+_not_precedence = 3
+_compare_precedence = 4
+_add_precedence = 5
+
+# Binary operators, by token type or keyword: (precedence, node). All are left-associative.
+_keyword_operators = {
+    'or': (_or_precedence, Node.Or),
+    'and': (_and_precedence, Node.And)
+}
+_binary_operators = {
+    'add': (_add_precedence, Node.Add),
+    'sub': (6, Node.Sub),
+    'mul': (7, Node.Mul),
+    'div': (8, Node.Div),
+    'floordiv': (9, Node.FloorDiv),
+    'mod': (10, Node.Mod),
+    'pow': (11, Node.Pow)
+}
+
 
 class NodeVisitor(object):
     def get_visitor(self, node):
@@ -28,43 +54,199 @@ class NodeVisitor(object):
             self.visit(node, *args, **kwargs)
 
 
+class NodeTransformer(NodeVisitor):
+    """ Visitor that replaces each node by what its visit method returns.
+
+    Returning None removes the node, returning a list splices the nodes into
+    the enclosing body.
+    """
+
+    def generic_visit(self, node, *args, **kwargs):
+        for field, old_value in node.iter_fields():
+            if isinstance(old_value, list):
+                new_values = []
+                for value in old_value:
+                    if isinstance(value, Node.Node):
+                        value = self.visit(value, *args, **kwargs)
+                        if value is None:
+                            continue
+                        elif not isinstance(value, Node.Node):
+                            new_values.extend(value)
+                            continue
+                    new_values.append(value)
+                old_value[:] = new_values
+            elif isinstance(old_value, Node.Node):
+                setattr(node, field, self.visit(old_value, *args, **kwargs))
+        return node
+
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.iter_child_nodes())
+    return count
+
+
+def count_levels(node):
+    """ The depth of the tree under node, node included """
+    levels = 0
+    stack = [(node, 1)]
+    while stack:
+        node, level = stack.pop()
+        levels = max(levels, level)
+        stack.extend((child, level + 1) for child in node.iter_child_nodes())
+    return levels
+
+
+class Block(object):
+    """ A statement being parsed: the items that follow go into body, until a block start followed by one of end_tokens.
+
+    parse_end is then called with the block, and returns True once the
+    statement is complete (an elif or an else gives the block a new body).
+    """
+
+    __slots__ = ('node', 'parse_end', 'body', 'end_tokens', 'current', 'depth')
+
+    def __init__(self, node, parse_end, body=None, end_tokens=None, depth=0):
+        self.node = node
+        self.parse_end = parse_end
+        self.body = body
+        self.end_tokens = end_tokens
+        # The node whose body is being parsed, for statements with several bodies
+        self.current = node
+        # Statements enclosing the items of body, current included: an elif nests one level deeper
+        self.depth = depth
+
+
 class Parser(NodeVisitor):
-    def __init__(self, lexer, source):
+    """ Builds the tree of a template from its tokens.
+
+    Statements are parsed with an explicit stack of blocks, so that nesting
+    depth never turns into Python recursion. max_depth (statements nested
+    in each other, plus the levels of operations of the expressions in them,
+    the depth of the tree that later passes recurse on), max_tokens and
+    max_nodes bound the work done on a template; exceeding one raises a
+    TemplateSyntaxException. None disables a limit.
+    """
+
+    def __init__(self, lexer, source, stream=None, max_depth=None, max_tokens=None, max_nodes=None):
         self.source = source
-        self.stream = lexer.tokenize(source)
-        self._end_token_stack = []
+        # stream: the tokens of source when they are already known (an ArrayTokenStream), source then
+        # only serves to locate errors and may be None, as for the tokens of Lexer.tokenize_file()
+        self.stream = stream if stream is not None else lexer.tokenize_all(source, max_tokens)
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.node_count = 0
+        # Statements enclosing the statement being parsed, itself included
+        self.depth = 0
+        if max_tokens is not None and len(self.stream.tokens) - 1 > max_tokens:
+            raise TemplateSyntaxException('Template has more than %d tokens' % max_tokens)
 
     def parse(self):
-        return Node.Template(self.subparse())
+        try:
+            return Node.Template(self.subparse())
+        except TemplateSyntaxException as error:
+            error.locate(self.source)
+            raise
+        except RecursionError:
+            # Only expressions still recurse, e.g. on thousands of nested parentheses
+            raise TemplateSyntaxException('Expression is nested too deeply', self.stream.current.position)
+
+    def parse_items(self):
+        """ Parses the template body one top-level item (text, variable or whole statement) at a time.
+
+        Returns a (index of its first token, index after its last token, nodes)
+        triple for each item, so that an item can be parsed again on its own.
+        """
+        items = []
+        try:
+            while self.stream:
+                start = self.stream.mark()
+                nodes = []
+                self.subparse_item(nodes)
+                items.append((start, self.stream.mark(), nodes))
+        except TemplateSyntaxException as error:
+            error.locate(self.source)
+            raise
+        except RecursionError:
+            raise TemplateSyntaxException('Expression is nested too deeply', self.stream.current.position)
+        return items
 
     def subparse(self, end_tokens=None):
         body = []
 
         while self.stream:
+            if not self.subparse_item(body, end_tokens):
+                break
+
+        return body
+
+    def subparse_item(self, body, end_tokens=None):
+        """ Adds the nodes of the next item, a whole statement included, to body.
+
+        Returns False, past the block start, on one of end_tokens.
+        """
+        stack = []
+        while True:
             token = self.stream.current
+            target = stack[-1].body if stack else body
+            depth = stack[-1].depth if stack else 0
 
             if token.token_type == TOKEN_DATA:
                 next(self.stream)
                 if token.value:
-                    body.append(Node.Value(token.value))
+                    self.add_nodes(1)
+                    target.append(Node.Value(token.value))
             elif token.token_type == TOKEN_VARIABLE_START:
                 next(self.stream)
-                body.append(self.parse_tuple(with_conditional_expression=True))
+                node = self.parse_tuple(with_conditional_expression=True)
+                self.add_nodes(count_nodes(node))
+                self.check_depth(depth, node, token.position)
+                target.append(node)
                 self.stream.expect(TOKEN_VARIABLE_END)
             elif token.token_type == TOKEN_BLOCK_START:
                 # parses the entire block. ex:  ->{% if True%} 10 {%endif%}{{item}} changes to ->{{item}}
                 # (-> represents the current token)
 
                 next(self.stream)
-                if end_tokens is not None and self.stream.current.test_any(*end_tokens):
-                    return body
-
-                result = self.parse_statement()
-                self.add_result_to_body(result, body)
+                if not stack and end_tokens is not None and self.stream.current.test_any(*end_tokens):
+                    return False
+                elif stack and self.stream.current.test_any(*stack[-1].end_tokens):
+                    block = stack[-1]
+                    if block.parse_end(block):
+                        stack.pop()
+                        self.add_result_to_body(block.node, stack[-1].body if stack else body)
+                else:
+                    self.depth = depth + 1
+                    self.check_statement_depth(self.depth, token.position)
+                    stack.append(self.parse_statement())
+                    continue
+            elif token.token_type == TOKEN_EOF:
+                raise TemplateSyntaxException('Reached unexpected end of file', token.position)
             else:
                 raise TemplateParsingException('Internal parsing error: %s.' % token)
 
-        return body
+            if not stack:
+                return True
+
+    def add_nodes(self, count):
+        self.node_count += count
+        if self.max_nodes is not None and self.node_count > self.max_nodes:
+            raise TemplateSyntaxException('Template has more than %d nodes' % self.max_nodes,
+                                          self.stream.current.position)
+
+    def check_statement_depth(self, depth, position):
+        if self.max_depth is not None and depth > self.max_depth:
+            raise TemplateSyntaxException('Statements are nested more than %d deep' % self.max_depth, position)
+
+    def check_depth(self, depth, node, position):
+        """ Checks the expression node, inside depth statements: each level of its operations counts as one more """
+        if self.max_depth is not None and depth + count_levels(node) - 1 > self.max_depth:
+            raise TemplateSyntaxException('Expression is more than %d levels deep, counting its operations '
+                                          'and the statements around it' % self.max_depth, position)
 
     def add_result_to_body(self, result, body):
         if isinstance(result, list):
@@ -73,9 +255,10 @@ class Parser(NodeVisitor):
             body.append(result)
 
     def parse_statement(self):
+        """ Parses the start of a statement up to its block end, and returns the Block receiving its body """
         token = self.stream.current
         if not token.test('name'):
-            raise TemplateSyntaxException('Unknown token %s' % token.value)
+            raise TemplateSyntaxException('Unknown token %s' % token.value, token.position)
 
         if token.value in _statement_keywords:
             parse_method = getattr(self, 'parse_' + token.value)
@@ -107,7 +290,7 @@ class Parser(NodeVisitor):
             if items:
                 return items[0]
             if not explicit_parentheses:
-                raise TemplateSyntaxException('Cannot allow empty element')
+                raise TemplateSyntaxException('Cannot allow empty element', self.stream.current.position)
 
         return Node.Tuple(items)
 
@@ -122,12 +305,12 @@ class Parser(NodeVisitor):
     def parse_expression(self, with_conditional_expression=True):
         if with_conditional_expression:
             return self.parse_conditional_expression()
-        return self.parse_or()
+        return self.parse_binary(_or_precedence)
 
     def parse_conditional_expression(self):
-        expr = self.parse_or()
+        expr = self.parse_binary(_or_precedence)
         while self.stream.skip_if('name:if'):
-            condition = self.parse_or()
+            condition = self.parse_binary(_or_precedence)
             if self.stream.skip_if('name:else'):
                 else_expr = self.parse_expression()
             else:
@@ -135,100 +318,57 @@ class Parser(NodeVisitor):
             expr = Node.Cond(condition, expr, else_expr)
         return expr
 
-    def parse_or(self):
-        left = self.parse_and()
-        while self.stream.skip_if('name:or'):
-            right = self.parse_and()
-            left = Node.Or(left, right)
-        return left
+    def parse_binary(self, min_precedence):
+        """ Parses an operand and the operators of at least min_precedence that follow, climbing the table """
+        stream = self.stream
+        if min_precedence <= _not_precedence and stream.current.test('name:not'):
+            next(stream)
+            left = Node.Not(self.parse_binary(_not_precedence))
+        else:
+            left = self.parse_unary()
+
+        while True:
+            token = stream.current
+            token_type = token.token_type
+            if token_type in _binary_operators:
+                precedence, node_class = _binary_operators[token_type]
+            elif token_type == 'name' and token.value in _keyword_operators:
+                precedence, node_class = _keyword_operators[token.value]
+            elif token_type in _compare_operators or token_type == 'name' and self.is_membership_test(token):
+                if _compare_precedence < min_precedence:
+                    break
+                left = self.parse_compare(left)
+                continue
+            else:
+                break
 
-    def parse_and(self):
-        left = self.parse_not()
-        while self.stream.skip_if('name:and'):
-            right = self.parse_not()
-            left = Node.And(left, right)
+            if precedence < min_precedence:
+                break
+            next(stream)
+            # Left-associative: the right operand only takes tighter operators
+            left = node_class(left, self.parse_binary(precedence + 1))
         return left
 
-    def parse_not(self):
-        if self.stream.skip_if('name:not'):
-            return Node.Not(self.parse_not())
-        return self.parse_compare()
+    def is_membership_test(self, token):
+        return token.value == 'in' or token.value == 'not' and self.stream.look().test('name:in')
 
-    def parse_compare(self):
-        left = self.parse_add()
+    def parse_compare(self, left):
+        """ Comparisons following left make a single Compare node """
         ops = []
         while True:
             token_type = self.stream.current.token_type
             if token_type in _compare_operators:
                 next(self.stream)
-                ops.append(Node.Operand(token_type, self.parse_and()))
+                ops.append(Node.Operand(token_type, self.parse_binary(_and_precedence)))
             elif self.stream.skip_if('name:in'):
-                ops.append(Node.Operand('in', self.parse_add()))
+                ops.append(Node.Operand('in', self.parse_binary(_add_precedence)))
             elif self.stream.current.test('name:not') and self.stream.look().test('name:in'):
                 self.stream.skip(2)
-                ops.append(Node.Operand('notin', self.parse_add()))
+                ops.append(Node.Operand('notin', self.parse_binary(_add_precedence)))
             else:
                 break
-        if not ops:
-            return left
         return Node.Compare(left, ops)
 
-    def parse_add(self):
-        left = self.parse_sub()
-        while self.stream.current.token_type == 'add':
-            next(self.stream)
-            right = self.parse_sub()
-            left = Node.Add(left, right)
-        return left
-
-    def parse_sub(self):
-        left = self.parse_mul()
-        while self.stream.current.token_type == 'sub':
-            next(self.stream)
-            right = self.parse_mul()
-            left = Node.Sub(left, right)
-        return left
-
-    def parse_mul(self):
-        left = self.parse_div()
-        while self.stream.current.token_type == 'mul':
-            next(self.stream)
-            right = self.parse_div()
-            left = Node.Mul(left, right)
-        return left
-
-    def parse_div(self):
-        left = self.parse_floor_div()
-        while self.stream.current.token_type == 'div':
-            next(self.stream)
-            right = self.parse_floor_div()
-            left = Node.Div(left, right)
-        return left
-
-    def parse_floor_div(self):
-        left = self.parse_mod()
-        while self.stream.current.token_type == 'floordiv':
-            next(self.stream)
-            right = self.parse_mod()
-            left = Node.FloorDiv(left, right)
-        return left
-
-    def parse_mod(self):
-        left = self.parse_pow()
-        while self.stream.current.token_type == 'mod':
-            next(self.stream)
-            right = self.parse_pow()
-            left = Node.Mod(left, right)
-        return left
-
-    def parse_pow(self):
-        left = self.parse_unary()
-        while self.stream.current.token_type == 'pow':
-            next(self.stream)
-            right = self.parse_unary()
-            left = Node.Pow(left, right)
-        return left
-
     def parse_unary(self):
         token_type = self.stream.current.token_type
         if token_type == 'sub':
@@ -259,7 +399,7 @@ class Parser(NodeVisitor):
         elif token_type == 'lbrace':
             return self.parse_dict()
         else:
-            raise TemplateSyntaxException('Unknown token %s' % self.stream.current)
+            raise TemplateSyntaxException('Unknown token %s' % self.stream.current, self.stream.current.position)
 
     def parse_name(self, token_value):
         try:
@@ -337,7 +477,7 @@ class Parser(NodeVisitor):
         elif token.token_type == 'lbracket':
             return self.parse_bracket_subscript(node)
 
-        raise TemplateSyntaxException('Parsing error: cannot parse subscript')
+        raise TemplateSyntaxException('Parsing error: cannot parse subscript', token.position)
 
     def parse_dot_subscript(self, node):
         """  foo.->bar ... into foo.bar->... """
@@ -443,51 +583,59 @@ class Parser(NodeVisitor):
 
     def parse_if(self):
         self.stream.expect('name:if')
-        first_node = node = Node.If()
-        while True:
-
-            node.test = self.parse_tuple(with_conditional_expression=False)
+        node = Node.If()
+        block = Block(node, self.parse_if_end)
+        self.parse_if_branch(block, node, self.depth)
+        return block
+
+    def parse_if_branch(self, block, node, depth):
+        position = self.stream.current.position
+        node.test = self.parse_tuple(with_conditional_expression=False)
+        self.stream.expect(TOKEN_BLOCK_END)
+        self.add_nodes(1 + count_nodes(node.test))
+        self.check_depth(depth, node.test, position)
+        node.body = block.body = []
+        block.current = node
+        block.end_tokens = _if_end_tokens
+        block.depth = depth
+
+    def parse_if_end(self, block):
+        if self.stream.skip_if('name:elif'):
+            # {% elif ->... %} ...
+            # The If of an elif is in the else body of the previous branch, one level deeper
+            self.check_statement_depth(block.depth + 1, self.stream.current.position)
+            node = Node.If()
+            block.current.else_body = [node]
+            self.parse_if_branch(block, node, block.depth + 1)
+            return False
+        elif self.stream.skip_if('name:else'):
+            # {% else ->%} ... {% endif %}
             self.stream.expect(TOKEN_BLOCK_END)
-            node.body = self.parse_statements(['name:elif', 'name:else', 'name:endif'])
-
-            if self.stream.skip_if('name:elif'):
-                # {% elif ->... %} ...
-                new_node = Node.If()
-                node.else_body = [new_node]
-                node = new_node
-                continue
-            elif self.stream.skip_if('name:else'):
-                # {% else ->%} ... {% endif %}
-                self.stream.expect(TOKEN_BLOCK_END)
-                node.else_body = self.parse_statements(['name:endif'])
-                self.stream.expect('name:endif')
-                self.stream.expect(TOKEN_BLOCK_END)
-                break
-            elif self.stream.skip_if('name:endif'):
-                # ... {% endif ->%}
-                self.stream.expect(TOKEN_BLOCK_END)
-                node.else_body = []
-                break
+            block.current.else_body = block.body = []
+            block.end_tokens = _else_end_tokens
+            return False
 
-        return first_node
+        # ... {% endif ->%}
+        if block.end_tokens is not _else_end_tokens:
+            block.current.else_body = []
+        self.stream.expect('name:endif')
+        self.stream.expect(TOKEN_BLOCK_END)
+        return True
 
     def parse_for(self):
         self.stream.expect('name:for')
         target = Node.Value(self.stream.expect('name').value)
         self.stream.expect('name:in')
+        position = self.stream.current.position
         items = self.parse_tuple(with_conditional_expression=False)
         self.stream.expect(TOKEN_BLOCK_END)
+        self.add_nodes(2 + count_nodes(items))
+        self.check_depth(self.depth, items, position)
 
-        body = self.parse_statements(['name:endfor'])
+        node = Node.For(target, items, [])
+        return Block(node, self.parse_for_end, node.body, _for_end_tokens, self.depth)
+
+    def parse_for_end(self, block):
         self.stream.expect('name:endfor')
         self.stream.expect(TOKEN_BLOCK_END)
-
-        return Node.For(target, items, body)
-
-    def parse_statements(self, end_tokens, remove_end_token=False):
-        result = self.subparse(end_tokens)
-
-        if remove_end_token:
-            next(self.stream)
-
-        return result
\ No newline at end of file
+        return True
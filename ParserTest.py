@@ -1,4 +1,7 @@
+import random
 import unittest
+from DescentParser import DescentParser
+from Exception import TemplateSyntaxException
 from Lexer import Lexer
 from Parser import Parser
 
@@ -12,22 +15,30 @@ class ParserTest(unittest.TestCase):
             def tokenize(self, source):
                 return self.lexer.tokenize(source)
 
+            def tokenize_all(self, source, max_tokens=None):
+                return self.lexer.tokenize_all(source, max_tokens)
+
         return Environment()
 
     def make_object_with_attr(self, attr, value):
         return type('Dummy object', (object, ), {attr: value})
 
+    def parse(self, source):
+        return Parser(self.make_environment(), source).parse()
+
+    def render_outputs(self, parsed_source):
+        """ The outputs to check: tests of another backend override parse() and this, and run every test again """
+        return [parsed_source.render(self.items)]
+
     def assert_source_parses_and_renders_correctly(self):
-        environment = self.make_environment()
-        parser = Parser(environment, self.source)
-        parsed_source = parser.parse()
-        rendered_source = parsed_source.render(self.items)
+        parsed_source = self.parse(self.source)
         print("Parsed source: ", parsed_source)
 
-        if isinstance(self.result, list):
-            self.assertIn(rendered_source, self.result)
-        else:
-            self.assertEqual(self.result, rendered_source)
+        for rendered_source in self.render_outputs(parsed_source):
+            if isinstance(self.result, list):
+                self.assertIn(rendered_source, self.result)
+            else:
+                self.assertEqual(self.result, rendered_source)
 
     def test_can_do_data(self):
         self.source = 'hello world!'
@@ -252,5 +263,89 @@ class ParserTest(unittest.TestCase):
 
 
 
+class ExpressionParserTest(unittest.TestCase):
+    """ The precedence table must give the trees of the recursive descent parser """
+
+    expressions = [
+        'a + b - c * d / e // f % g ** h',
+        'a ** b ** c - d - e',
+        '-a ** -b + +c',
+        'not a and b or not not c',
+        'a == b and c',
+        'a < b < c',
+        'a in b < c or d not in e + f',
+        'not a in b',
+        'a if b else c if d',
+        'a.b[c](d, *e, **f) * g[1:2:3]',
+        '(a, b) + [c, {d: e}]',
+        'a + not b'
+    ]
+
+    def parse(self, parser_class, source):
+        try:
+            return repr(parser_class(Lexer(), source).parse())
+        except Exception as error:
+            return str(error)
+
+    def assert_same_tree(self, source):
+        self.assertEqual(self.parse(DescentParser, source), self.parse(Parser, source), source)
+
+    def test_expressions(self):
+        for expression in self.expressions:
+            self.assert_same_tree('{{ %s }}' % expression)
+
+    def test_random_expressions(self):
+        operands = ['a', '1', '-b', 'not c', '(d)', 'e.f', '"g"']
+        operators = ['+', '-', '*', '/', '//', '%', '**', '==', '!=', '<', '>=', 'in', 'not in', 'and', 'or']
+        generator = random.Random(0)
+        for _ in range(500):
+            parts = [generator.choice(operands)]
+            for _ in range(generator.randint(1, 6)):
+                parts.extend([generator.choice(operators), generator.choice(operands)])
+            self.assert_same_tree('{{ %s }}' % ' '.join(parts))
+
+
+class ParserLimitsTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer()
+
+    def nested_ifs(self, depth):
+        return '{% if a %}' * depth + 'x' + '{% endif %}' * depth
+
+    def test_deep_nesting_does_not_recurse(self):
+        node = Parser(self.lexer, self.nested_ifs(5000)).parse()
+        for _ in range(5000):
+            node = node.body[0]
+        self.assertEqual('x', node.body[0].value)
+
+    def test_depth_limit(self):
+        Parser(self.lexer, self.nested_ifs(3), max_depth=3).parse()
+        self.assertRaises(TemplateSyntaxException, Parser(self.lexer, self.nested_ifs(4), max_depth=3).parse)
+
+    def test_depth_limit_counts_operations(self):
+        Parser(self.lexer, '{% if a %}{{ a + b }}{% endif %}', max_depth=2).parse()
+        source = '{% if a %}{{ a + b + c }}{% endif %}'
+        with self.assertRaises(TemplateSyntaxException) as context:
+            Parser(self.lexer, source, max_depth=2).parse()
+        self.assertEqual(source.index('{{'), context.exception.position)
+        self.assertRaises(TemplateSyntaxException, Parser(self.lexer, '{% for i in a + b + c %}{% endfor %}',
+                                                          max_depth=2).parse)
+        self.assertRaises(TemplateSyntaxException, Parser(self.lexer, '{% if a %}{% elif b %}{% elif c %}{% endif %}',
+                                                          max_depth=2).parse)
+
+    def test_token_limit(self):
+        Parser(self.lexer, '{{ a }}', max_tokens=3)
+        self.assertRaises(TemplateSyntaxException, Parser, self.lexer, '{{ a.b }}', max_tokens=3)
+
+    def test_node_limit(self):
+        Parser(self.lexer, '{% for i in a %}{{ i }}{% endfor %}', max_nodes=4).parse()
+        source = '{% for i in a %}{{ i + 1 }}{% endfor %}'
+        self.assertRaises(TemplateSyntaxException, Parser(self.lexer, source, max_nodes=4).parse)
+
+    def test_deeply_nested_expression_is_a_syntax_error(self):
+        source = '{{ %sa%s }}' % ('(' * 10000, ')' * 10000)
+        self.assertRaises(TemplateSyntaxException, Parser(self.lexer, source).parse)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,44 @@
+from Parser import NodeVisitor
+
+
+class ScopeAnalyzer(NodeVisitor):
+    """ Tells the variables bound by a for-loop apart from the others, once, before rendering.
+
+    Each loop gets a slot, its nesting depth, and each variable naming the
+    target of an enclosing loop gets the slot of the innermost one. The
+    other variables, template globals and builtins, keep slot None and are
+    looked up in the scope stack. The template's slot_count is the number
+    of slots a render needs: a loop assigns its slot in place for each item
+    instead of pushing a scope, and the generated code uses a local.
+    """
+
+    def __init__(self):
+        # Targets of the enclosing loops, the innermost last: the index of a target is its slot
+        self.targets = []
+        self.slot_count = 0
+
+    def visit_Template(self, node):
+        self.generic_visit(node)
+        node.slot_count = self.slot_count
+
+    def visit_For(self, node):
+        # The items are evaluated before the target is bound: in 'for i in i' they are the outer i
+        self.visit(node.items)
+        node.slot = len(self.targets)
+        self.targets.append(node.target.value)
+        self.slot_count = max(self.slot_count, len(self.targets))
+        for item in node.body:
+            self.visit(item)
+        self.targets.pop()
+
+    def visit_Variable(self, node):
+        node.slot = None
+        for slot in range(len(self.targets) - 1, -1, -1):
+            if self.targets[slot] == node.name:
+                node.slot = slot
+                break
+
+
+def analyze_scopes(node):
+    ScopeAnalyzer().visit(node)
+    return node
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+from Lexer import Lexer
+from Parser import Parser
+from CompilerTest import compiled_outputs
+import ParserTest
+import Compiler
+from Scope import analyze_scopes
+
+
+class ScopeTest(ParserTest.ParserTest):
+    """ Runs every parser test again with loop variables in slots, through the tree and the generated code """
+
+    def parse(self, source):
+        return analyze_scopes(Parser(Lexer(), source).parse())
+
+    def render_outputs(self, parsed_source):
+        return ([parsed_source.render(self.items), ''.join(parsed_source.generate(self.items))]
+                + compiled_outputs(parsed_source, self.items))
+
+    def test_loops_get_their_depth_as_slot(self):
+        template = self.parse('{% for a in x %}{% for b in a %}{{ a }}{{ b }}{{ c }}{% endfor %}{% endfor %}'
+                              '{% for d in y %}{{ d }}{% endfor %}')
+        outer, second = template.body
+        inner = outer.body[0]
+        self.assertEqual((0, 1, 0), (outer.slot, inner.slot, second.slot))
+        self.assertEqual([0, 1, None], [variable.slot for variable in inner.body])
+        self.assertEqual(0, second.body[0].slot)
+        self.assertEqual(2, template.slot_count)
+
+    def test_items_are_evaluated_outside_the_loop(self):
+        template = self.parse('{% for i in i %}{{ i }}{% endfor %}{{ i }}')
+        self.assertIsNone(template.body[0].items.slot)
+        self.assertIsNone(template.body[1].slot)
+        self.assertEqual('ab[\'a\', \'b\']', template.render({'i': ['a', 'b']}))
+
+    def test_inner_loop_shadows_outer_target(self):
+        source = '{% for i in a %}{% for i in b %}{{ i }}{% endfor %}{{ i }}{% endfor %}{{ i }}'
+        template = self.parse(source)
+        context = {'a': [1, 2], 'b': 'xy', 'i': '!'}
+        self.assertEqual('xy1xy2!', template.render(context))
+        self.assertEqual('xy1xy2!', Compiler.load(Compiler.compile_template(template))['render'](context))
+
+    def test_generated_code_does_not_push_scopes(self):
+        template = self.parse('{% for row in rows %}{% for cell in row %}{{ cell }}{% endfor %}{% endfor %}')
+        source = Compiler.generate(template)
+        self.assertNotIn('context.append', source)
+        self.assertIn('for l_1 in l_0:', source)
+
+    def test_awaitable_items_are_awaited_once(self):
+        async def value(number):
+            return number
+
+        template = self.parse('{% for i in items %}{{ i }}{{ i + 1 }}{% endfor %}')
+        generate_async = Compiler.load(Compiler.compile_template(template))['generate_async']
+
+        async def render():
+            return ''.join([chunk async for chunk in generate_async({'items': [value(1), value(3)]})])
+
+        self.assertEqual('1234', asyncio.run(render()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,225 @@
-from Lexer import Lexer
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import marshal
+import sys
+from types import MappingProxyType
+from Lexer import ArrayTokenStream, Lexer
 from Parser import Parser
+import Compiler
+from Optimizer import optimize
+from Scope import analyze_scopes
+import Node
+import TemplateCache
+from Exception import TemplateSyntaxException
+
+DEFAULT_BUFFER_SIZE = 8192
+
+# Deeper trees would exhaust the Python stack in the passes over them
+DEFAULT_LIMITS = {'max_depth': 200}
+
+# The lexer keeps no per-call state, so all templates share one (and its compiled rules)
+_lexer = Lexer()
+
+# Template rendered by the render_many() worker processes, sent once per worker
+_worker_template = None
+
+
+def _initialize_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+def _render_chunk(contexts):
+    return list(_worker_template._render_many(contexts))
 
 
 class Template(object):
-    def __init__(self, source):
-        lexer = Lexer()
-        parser = Parser(lexer, source)
-        self.root = parser.parse()
+    def __init__(self, source, bytecode_cache=None, cache=TemplateCache.default_cache, limits=None,
+                 globals=Node.builtins):
+        """ limits: keyword arguments of Parser bounding the parse (max_depth, max_tokens, max_nodes).
+
+        They override DEFAULT_LIMITS, and apply when the source is parsed: a template
+        found in a cache was already parsed.
+        globals: the read-only mapping of the names every render sees, which must include
+        the builtins; an Environment passes its own.
+        """
+        self.source = source
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.globals = globals
+        self._root = None
+
+        if cache is not None:
+            cache_key = TemplateCache.get_cache_key(source)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                self._root, self.code, namespace = entry
+                self._set_namespace(namespace)
+                return
+
+        code = None
+        if bytecode_cache is not None:
+            key = bytecode_cache.get_cache_key(source)
+            code = bytecode_cache.load(key)
+
+        if code is None:
+            code = self._compile()
+            if bytecode_cache is not None:
+                bytecode_cache.dump(key, code)
+
+        self.code = code
+        namespace = Compiler.load(code)
+        self._set_namespace(namespace)
+
+        if cache is not None:
+            if self._root is not None:
+                size = TemplateCache.approximate_size(self._root)
+            else:
+                size = sys.getsizeof(code.co_code) + sys.getsizeof(source)
+            cache.set(cache_key, (self._root, code, namespace), size)
+
+    @classmethod
+    def from_file(cls, source, encoding='utf-8', limits=None, globals=Node.builtins):
+        """ A template read from a path, a binary file object or a buffer such as an mmap.
+
+        The file is tokenized window by window (see Lexer.tokenize_file), so its
+        text is never held in one string: the template has no source, is not
+        cached, and its syntax errors only know their offset.
+        """
+        template = cls.__new__(cls)
+        template.source = None
+        template.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        template.globals = globals
+        tokens = _lexer.tokenize_file(source, encoding)
+        max_tokens = template.limits.get('max_tokens')
+        if max_tokens is not None:
+            tokens = itertools.islice(tokens, max_tokens + 1)
+        template._root = template._prepare(Parser(_lexer, None, ArrayTokenStream(tokens), **template.limits).parse())
+        template.code = template._compile()
+        template._set_namespace(Compiler.load(template.code))
+        return template
+
+    def _prepare(self, root):
+        """ The passes run on a parsed tree before compiling it """
+        try:
+            return analyze_scopes(optimize(root))
+        except RecursionError:
+            raise TemplateSyntaxException('Template is nested too deeply')
+
+    def _compile(self):
+        try:
+            return Compiler.compile_template(self.root)
+        except RecursionError:
+            raise TemplateSyntaxException('Template is nested too deeply')
+        except (SyntaxError, MemoryError):
+            # compile() rejects the generated code when it nests too many parentheses
+            raise TemplateSyntaxException('Expression is nested too deeply to compile')
+
+    def _set_namespace(self, namespace):
+        self.namespace = namespace
+        self.render_function = namespace['render']
+        self.render_in = namespace['render_in']
+        # The whole output when the template has no dynamic part, None otherwise
+        self.static_output = namespace['static_output']
+
+    def __getstate__(self):
+        # The code object travels marshalled, so unpickling never lexes, parses or compiles
+        # The globals of an environment are sent as a copy, so their values must be picklable too
+        globals = None if self.globals is Node.builtins else dict(self.globals)
+        return {'source': self.source, 'root': self._root, 'code': marshal.dumps(self.code), 'globals': globals}
+
+    def __setstate__(self, state):
+        self.source = state['source']
+        self.limits = dict(DEFAULT_LIMITS)
+        self.globals = Node.builtins if state['globals'] is None else MappingProxyType(state['globals'])
+        self._root = state['root']
+        self.code = marshal.loads(state['code'])
+        self._set_namespace(Compiler.load(self.code))
+
+    @property
+    def root(self):
+        # Parsed on demand: a template loaded from the bytecode cache never needs its tree to render
+        if self._root is None:
+            self._root = self._prepare(Parser(_lexer, self.source, **self.limits).parse())
+        return self._root
 
     def render(self, **kwargs):
-        return self.root.render(kwargs)
\ No newline at end of file
+        # A template without dynamic parts needs no context at all
+        if self.static_output is not None:
+            return self.static_output
+        return self.render_in(Node.Context(self.globals, kwargs))
+
+    def render_many(self, contexts, workers=None, chunksize=64):
+        """ Renders the template once per context dictionary and yields the outputs, in order.
+
+        With workers, contexts are sent in chunks of chunksize to that many
+        processes, which receive the compiled template once; contexts and
+        outputs must then be picklable.
+        """
+        if not workers:
+            return self._render_many(contexts)
+        return self._render_many_in_processes(contexts, workers, chunksize)
+
+    def _render_many(self, contexts):
+        if self.static_output is not None:
+            for _ in contexts:
+                yield self.static_output
+            return
+        render_in = self.render_in
+        globals = self.globals
+        for context in contexts:
+            yield render_in(Node.Context(globals, context))
+
+    def _render_many_in_processes(self, contexts, workers, chunksize):
+        contexts = iter(contexts)
+        chunks = iter(lambda: list(itertools.islice(contexts, chunksize)), [])
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker,
+                                 initargs=(self, )) as executor:
+            # A bounded number of chunks is in flight, so huge inputs are never all submitted at once
+            pending = deque(executor.submit(_render_chunk, chunk) for chunk in itertools.islice(chunks, 2 * workers))
+            try:
+                while pending:
+                    outputs = pending.popleft().result()
+                    for chunk in itertools.islice(chunks, 1):
+                        pending.append(executor.submit(_render_chunk, chunk))
+                    yield from outputs
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def render_to(self, stream, context=None, buffer_size=DEFAULT_BUFFER_SIZE, encoding=None):
+        """ Writes the output into stream (anything with a write method) as it is rendered.
+
+        The variables come in the context dictionary, so that none can clash
+        with the options. Chunks are collected until at least buffer_size
+        characters are pending, then written at once; 0 writes every chunk.
+        With an encoding, bytes are written, e.g. for gzip files or sockets
+        opened with makefile('wb').
+        """
+        write = stream.write
+        buffer = []
+        buffered = 0
+        for chunk in self.namespace['generate'](Node.Context(self.globals, context or {})):
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= buffer_size:
+                data = ''.join(buffer)
+                write(data.encode(encoding) if encoding else data)
+                buffer.clear()
+                buffered = 0
+
+        if buffer:
+            data = ''.join(buffer)
+            write(data.encode(encoding) if encoding else data)
+
+    def generate(self, **kwargs):
+        """ Yields the output in chunks as it is rendered, instead of returning one string """
+        return self.namespace['generate'](Node.Context(self.globals, kwargs))
+
+    def generate_async(self, **kwargs):
+        """ Async generator of the output: awaitable variables and call results are awaited where they are used """
+        return self.namespace['generate_async'](Node.Context(self.globals, kwargs))
+
+    async def render_async(self, **kwargs):
+        return ''.join([chunk async for chunk in self.generate_async(**kwargs)])
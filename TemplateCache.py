@@ -0,0 +1,88 @@
+from collections import OrderedDict
+import hashlib
+import sys
+import threading
+import Node
+
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+
+def approximate_size(node):
+    """ Rough number of bytes held by a tree of nodes (nodes, their attributes and the values they hold) """
+    size = 0
+    seen = set()
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+
+        if isinstance(item, Node.Node):
+            if hasattr(item, '__dict__'):
+                size += sys.getsizeof(item.__dict__)
+            stack.extend(value for _, value in item.iter_fields())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return size
+
+
+def get_cache_key(source):
+    return hashlib.sha1(source.encode('utf-8', 'surrogatepass')).digest()
+
+
+class TemplateCache(object):
+    """ Process-wide LRU cache of compiled templates, bounded by the approximate size of their trees.
+
+    Templates with byte-identical sources share one entry. hits, misses and
+    evictions count what happened since the cache was created or cleared.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, size = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self.current_size -= self._entries.pop(key)[1]
+
+            # An entry bigger than the whole budget would only evict everything else
+            if size > self.max_size:
+                return
+
+            self._entries[key] = (value, size)
+            self.current_size += size
+            while self.current_size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_size = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+default_cache = TemplateCache()
@@ -0,0 +1,43 @@
+import unittest
+from Lexer import Lexer
+from Parser import Parser
+from Template import Template
+from TemplateCache import TemplateCache, approximate_size
+
+
+class TemplateCacheTest(unittest.TestCase):
+    def test_identical_sources_share_compiled_template(self):
+        cache = TemplateCache()
+        first = Template('{{ foo }}!', cache=cache)
+        second = Template('{{ foo }}!', cache=cache)
+
+        self.assertIs(first.render_function, second.render_function)
+        self.assertEqual('bar!', second.render(foo='bar'))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TemplateCache(max_size=250)
+        cache.set('a', 'A', 100)
+        cache.set('b', 'B', 100)
+        cache.get('a')
+        cache.set('c', 'C', 100)
+
+        self.assertEqual('A', cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(200, cache.current_size)
+
+    def test_entry_bigger_than_budget_is_not_stored(self):
+        cache = TemplateCache(max_size=10)
+        cache.set('a', 'A', 100)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.current_size)
+
+    def test_bigger_trees_have_bigger_sizes(self):
+        small = Parser(Lexer(), '{{ a }}').parse()
+        big = Parser(Lexer(), '{% for i in a %}{{ i + 1 }}{% endfor %}' * 10).parse()
+        self.assertLess(approximate_size(small), approximate_size(big))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import gzip
+import io
+import pickle
+from types import MappingProxyType
+import unittest
+from unittest import mock
+from Exception import TemplateSyntaxException
+from Lexer import Lexer
+import Node
+from Parser import Parser
+from Template import Template
+
+
+class RecordingStream(object):
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+class RenderToTest(unittest.TestCase):
+    def setUp(self):
+        self.template = Template('<ul>{% for i in items %}<li>{{ i }}</li>{% endfor %}</ul>')
+
+    def test_writes_the_rendered_output(self):
+        stream = io.StringIO()
+        self.template.render_to(stream, {'items': range(3)})
+        self.assertEqual(self.template.render(items=range(3)), stream.getvalue())
+
+    def test_output_is_buffered(self):
+        stream = RecordingStream()
+        self.template.render_to(stream, {'items': range(10)}, buffer_size=20)
+
+        self.assertEqual(self.template.render(items=range(10)), ''.join(stream.writes))
+        self.assertTrue(all(len(data) >= 20 for data in stream.writes[:-1]))
+        self.assertLess(len(stream.writes), 10)
+
+    def test_buffer_size_zero_writes_every_chunk(self):
+        stream = RecordingStream()
+        self.template.render_to(stream, {'items': range(2)}, buffer_size=0)
+        self.assertEqual(['<ul>', '<li>', '0', '</li>', '<li>', '1', '</li>', '</ul>'], stream.writes)
+
+    def test_can_write_encoded_bytes(self):
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as stream:
+            self.template.render_to(stream, {'items': ['é']}, encoding='utf-8')
+        self.assertEqual('<ul><li>é</li></ul>', gzip.decompress(compressed.getvalue()).decode('utf-8'))
+
+    def test_variables_may_be_named_like_options(self):
+        stream = io.StringIO()
+        Template('{{ encoding }} {{ buffer_size }}').render_to(stream, {'encoding': 'latin-1', 'buffer_size': 3})
+        self.assertEqual('latin-1 3', stream.getvalue())
+
+
+class RenderManyTest(unittest.TestCase):
+    def setUp(self):
+        self.template = Template('{{ name }}:{% for i in range(count) %}*{% endfor %}')
+        self.contexts = [{'name': 'row%d' % i, 'count': i % 4} for i in range(50)]
+        self.expected = [self.template.render(**context) for context in self.contexts]
+
+    def test_renders_every_context_in_order(self):
+        self.assertEqual(self.expected, list(self.template.render_many(self.contexts)))
+
+    def test_can_render_in_worker_processes(self):
+        outputs = self.template.render_many(iter(self.contexts), workers=2, chunksize=7)
+        self.assertEqual(self.expected, list(outputs))
+
+    def test_pickled_template_does_not_need_the_source_again(self):
+        template = pickle.loads(pickle.dumps(self.template))
+        self.assertEqual(self.expected[3], template.render(**self.contexts[3]))
+
+    def test_node_trees_survive_pickling(self):
+        tree = Parser(Lexer(), '{% for i in foo %}{% if i > 1 %}{{ i.bar[1:2] }}{% endif %}{% endfor %}').parse()
+        self.assertEqual(repr(tree), repr(pickle.loads(pickle.dumps(tree))))
+
+
+class FromFileTest(unittest.TestCase):
+    def test_renders_like_a_template_from_a_string(self):
+        source = '{% for i in items %}<{{ i * 2 }}>{% endfor %}' + 'x' * 1000
+        template = Template.from_file(io.BytesIO(source.encode('utf-8')))
+        self.assertIsNone(template.source)
+        self.assertEqual(Template(source).render(items=[1, 2]), template.render(items=[1, 2]))
+        self.assertEqual(template.render(items=[3]), pickle.loads(pickle.dumps(template)).render(items=[3]))
+
+    def test_limits_apply(self):
+        self.assertRaises(TemplateSyntaxException, Template.from_file, b'{{ a }}{{ b }}', limits={'max_tokens': 3})
+        self.assertRaises(TemplateSyntaxException, Template.from_file, b'{% if a %}' * 101)
+
+    def test_errors_know_their_offset(self):
+        with self.assertRaises(TemplateSyntaxException) as context:
+            Template.from_file(b'text {{ a ) }}')
+        self.assertEqual(10, context.exception.position)
+
+
+class LimitsTest(unittest.TestCase):
+    @staticmethod
+    def nested_ifs(depth):
+        return '{% if a %}' * depth + 'x' + '{% endif %}' * depth
+
+    def test_depth_is_limited_by_default(self):
+        self.assertEqual('x', Template(self.nested_ifs(200), cache=None).render(a=True))
+        self.assertRaises(TemplateSyntaxException, Template, self.nested_ifs(201), cache=None)
+        self.assertRaises(TemplateSyntaxException, Template, self.nested_ifs(1000), cache=None)
+
+    def test_limits_override_the_defaults(self):
+        self.assertRaises(TemplateSyntaxException, Template, self.nested_ifs(3), cache=None, limits={'max_depth': 2})
+        self.assertEqual('x', Template(self.nested_ifs(150), cache=None, limits={'max_depth': None}).render(a=True))
+
+    def test_too_deep_trees_raise_a_syntax_error(self):
+        self.assertRaises(TemplateSyntaxException, Template, self.nested_ifs(1000), cache=None,
+                          limits={'max_depth': None})
+        # Right-nested comparisons need as many parentheses in the generated code, more than compile() accepts
+        comparisons = '{{ ' + ' < '.join(['a'] * 199) + ' }}'
+        self.assertRaises(TemplateSyntaxException, Template, comparisons, cache=None, limits={'max_depth': None})
+
+    def test_operations_count_towards_the_depth(self):
+        self.assertEqual('150', Template('{{ ' + ' + '.join(['a'] * 150) + ' }}', cache=None).render(a=1))
+        with self.assertRaises(TemplateSyntaxException) as context:
+            Template('{{ ' + ' + '.join(['a'] * 400) + ' }}', cache=None)
+        self.assertIn('Expression is more than 200 levels deep', str(context.exception))
+        nested_sum = '{% if a %}' * 100 + '{{ ' + ' + '.join(['a'] * 150) + ' }}' + '{% endif %}' * 100
+        self.assertRaises(TemplateSyntaxException, Template, nested_sum, cache=None)
+
+    def test_elifs_count_towards_the_depth(self):
+        def elifs(count):
+            return '{% if a %}' + '{% elif a %}' * count + '{% endif %}'
+
+        self.assertEqual('', Template(elifs(150), cache=None).render(a=False))
+        self.assertRaises(TemplateSyntaxException, Template, elifs(300), cache=None)
+
+
+class StaticTemplateTest(unittest.TestCase):
+    def test_static_template_builds_no_context(self):
+        template = Template('{% if True %}x{{ 2 * 3 }}{% endif %}', cache=None)
+        with mock.patch.object(Node, 'Context', side_effect=AssertionError('a context was built')):
+            self.assertEqual('x6', template.render(unused=1))
+            self.assertEqual(['x6', 'x6'], list(template.render_many([{}, {'a': 1}])))
+
+
+class GlobalsTest(unittest.TestCase):
+    def setUp(self):
+        self.globals = MappingProxyType(dict(Node.builtins, site='example.org'))
+        self.template = Template('{{ site }} {{ upper(name) }}', globals=self.globals)
+
+    def test_every_render_sees_the_globals(self):
+        self.assertEqual('example.org BOB', self.template.render(name='bob'))
+        self.assertEqual(['example.org A', 'example.org B'],
+                         list(self.template.render_many([{'name': 'a'}, {'name': 'b'}])))
+        self.assertEqual('example.org BOB', ''.join(self.template.generate(name='bob')))
+
+    def test_variables_shadow_globals(self):
+        self.assertEqual('here BOB', self.template.render(site='here', name='bob'))
+
+    def test_globals_survive_pickling(self):
+        template = pickle.loads(pickle.dumps(self.template))
+        self.assertEqual('example.org BOB', template.render(name='bob'))
+        self.assertIs(Node.builtins, pickle.loads(pickle.dumps(Template('{{ a }}'))).globals)
+
+
+if __name__ == '__main__':
+    unittest.main()
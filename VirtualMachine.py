@@ -0,0 +1,394 @@
+from array import array
+import marshal
+import Node
+from Compiler import literal, missing_else
+from Parser import NodeVisitor
+
+# Every instruction is two integers: an opcode and its operand (0 when unused).
+# Jump operands are indexes in the code array, other operands index the constants table.
+# execute() compares opcodes with these numbers written as literals, which is
+# faster than looking the names up: renumbering an opcode means updating it too.
+OUTPUT_CONSTANT = 0      # writes constants[operand], a string
+OUTPUT = 1               # pops a value and writes it as a string
+CONSTANT = 2             # pushes constants[operand]
+LOAD = 3                 # pushes the variable named constants[operand]
+LOAD_ATTR = 4            # pushes an attribute of a variable, named by the pair constants[operand]
+GETATTR = 5              # replaces the top of the stack by its attribute constants[operand]
+GETITEM = 6              # pops a key and an object, pushes object[key]
+CALL = 7                 # calls a function with the arguments described by constants[operand]
+BINARY = 8               # pops two values, pushes _binary_functions[operand](left, right)
+UNARY = 9                # replaces the top of the stack by _unary_functions[operand](value)
+COMPARE = 10             # pops two values, pushes _compare_functions[operand](left, right)
+COMPARE_OR_JUMP = 11     # operand is target << 3 | operator: like COMPARE, but jumps to target with a false
+                         # result, and otherwise pushes the right value, for the next comparison of a chain
+JUMP = 12
+JUMP_IF_FALSE = 13       # pops the condition
+JUMP_IF_FALSE_OR_POP = 14
+JUMP_IF_TRUE_OR_POP = 15
+TO_STRING = 16
+MISSING_ELSE = 17
+BUILD_LIST = 18          # pops operand values
+BUILD_TUPLE = 19
+BUILD_DICT = 20          # pops operand keys and values, alternating
+BUILD_SLICE = 21         # pops start, stop and step
+GET_ITER = 22            # replaces the iterable on top of the stack by operand, the index after the loop, and an iterator
+FOR_ITER = 23            # pushes a scope binding the name constants[operand] to the next item, or
+                         # pops the exhausted iterator and jumps to the index after the loop
+END_FOR = 24             # pops the scope of the item and jumps back to the FOR_ITER at operand
+RETURN = 25              # ends every program
+
+opcode_names = ('OUTPUT_CONSTANT', 'OUTPUT', 'CONSTANT', 'LOAD', 'LOAD_ATTR', 'GETATTR', 'GETITEM', 'CALL', 'BINARY',
+                'UNARY', 'COMPARE', 'COMPARE_OR_JUMP', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP',
+                'JUMP_IF_TRUE_OR_POP', 'TO_STRING', 'MISSING_ELSE', 'BUILD_LIST', 'BUILD_TUPLE', 'BUILD_DICT',
+                'BUILD_SLICE', 'GET_ITER', 'FOR_ITER', 'END_FOR', 'RETURN')
+
+_binary_operators = tuple(Node._binary_operator_to_function)
+_binary_functions = tuple(Node._binary_operator_to_function.values())
+_unary_operators = tuple(Node._unary_operator_to_function)
+_unary_functions = tuple(Node._unary_operator_to_function.values())
+_compare_operators = tuple(Node._compare_operator_to_function)
+_compare_functions = tuple(Node._compare_operator_to_function.values())
+_compare_operator_bits = 3
+_compare_operator_mask = (1 << _compare_operator_bits) - 1
+
+# Returned by next() on an exhausted iterator (the items are never that object)
+_exhausted = object()
+
+
+class Program(object):
+    """ A template lowered to a flat instruction array and a table of constants.
+
+    Both hold only plain values (strings, numbers, tuples), so a program is
+    serialized with dumps() and loaded back with Program.loads().
+    """
+
+    __slots__ = ('code', 'constants')
+
+    def __init__(self, code, constants):
+        self.code = code
+        self.constants = constants
+
+    def render(self, context=None):
+        return execute(self, Node.build_context(context))
+
+    def dumps(self):
+        return marshal.dumps((self.code.tobytes(), tuple(self.constants)))
+
+    @classmethod
+    def loads(cls, data):
+        code_bytes, constants = marshal.loads(data)
+        code = array('i')
+        code.frombytes(code_bytes)
+        return cls(code, list(constants))
+
+    def disassemble(self):
+        """ One line per instruction: its index, opcode name and operand """
+        return '\n'.join('%4d %-20s %d' % (index, opcode_names[self.code[index]], self.code[index + 1])
+                         for index in range(0, len(self.code), 2))
+
+
+class Assembler(NodeVisitor):
+    """ Lowers the tree built by Parser.parse() into a Program, which execute() renders like Node.Template.render() """
+
+    def __init__(self):
+        self.code = array('i')
+        self.constants = []
+        self.constant_indexes = {}
+
+    def assemble(self, node):
+        self.visit(node)
+        self.emit(RETURN)
+        return Program(self.code, self.constants)
+
+    def constant(self, value):
+        # Keyed by type and literal, so that 1, 1.0 and True remain different constants
+        key = (type(value), literal(value))
+        index = self.constant_indexes.get(key)
+        if index is None:
+            index = self.constant_indexes[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def emit(self, opcode, operand=0):
+        """ Appends an instruction and returns its index, for jumps patched later """
+        self.code.append(opcode)
+        self.code.append(operand)
+        return len(self.code) - 2
+
+    def patch(self, index, target=None):
+        self.code[index + 1] = len(self.code) if target is None else target
+
+    ###########################################################################
+    #                                                                         #
+    #                              Statements                                 #
+    #                                                                         #
+    ###########################################################################
+
+    def visit_Template(self, node):
+        self.write_body(node.body)
+
+    def write_body(self, body):
+        for item in body:
+            if isinstance(item, (Node.If, Node.For)):
+                self.visit(item)
+            elif isinstance(item, Node.Value):
+                self.emit(OUTPUT_CONSTANT, self.constant(str(item.value)))
+            else:
+                self.visit(item)
+                self.emit(OUTPUT)
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        jump_to_else = self.emit(JUMP_IF_FALSE)
+        self.write_body(node.body)
+        if node.else_body:
+            jump_to_end = self.emit(JUMP)
+            self.patch(jump_to_else)
+            self.write_body(node.else_body)
+            self.patch(jump_to_end)
+        else:
+            self.patch(jump_to_else)
+
+    def visit_For(self, node):
+        self.visit(node.items)
+        setup = self.emit(GET_ITER)
+        loop = self.emit(FOR_ITER, self.constant(node.target.render()))
+        self.write_body(node.body)
+        self.emit(END_FOR, loop)
+        self.patch(setup)
+
+    ###########################################################################
+    #                                                                         #
+    #                              Expressions                                #
+    #                                                                         #
+    ###########################################################################
+
+    def visit_Value(self, node):
+        self.emit(CONSTANT, self.constant(node.value))
+
+    def visit_Variable(self, node):
+        self.emit(LOAD, self.constant(node.name))
+
+    def visit_List(self, node):
+        for item in node.items:
+            self.visit(item)
+        self.emit(BUILD_LIST, len(node.items))
+
+    def visit_Tuple(self, node):
+        for item in node.items:
+            self.visit(item)
+        self.emit(BUILD_TUPLE, len(node.items))
+
+    def visit_Dict(self, node):
+        for item in node.items:
+            self.visit(item.key)
+            self.visit(item.value)
+        self.emit(BUILD_DICT, len(node.items))
+
+    def visit_Slice(self, node):
+        for item in (node.start, node.stop, node.step):
+            if item:
+                self.visit(item)
+            else:
+                self.emit(CONSTANT, self.constant(None))
+        self.emit(BUILD_SLICE)
+
+    def visit_Cond(self, node):
+        self.visit(node.test)
+        jump_to_else = self.emit(JUMP_IF_FALSE)
+        self.visit(node.if_expr)
+        self.emit(TO_STRING)
+        jump_to_end = self.emit(JUMP)
+        self.patch(jump_to_else)
+        if node.else_expr:
+            self.visit(node.else_expr)
+            self.emit(TO_STRING)
+        else:
+            self.emit(MISSING_ELSE)
+        self.patch(jump_to_end)
+
+    def visit_BinaryExpr(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY, _binary_operators.index(node.operator))
+
+    visit_Add = visit_Sub = visit_Mul = visit_Div = visit_BinaryExpr
+    visit_FloorDiv = visit_Mod = visit_Pow = visit_BinaryExpr
+
+    def visit_And(self, node):
+        self.visit(node.left)
+        jump = self.emit(JUMP_IF_FALSE_OR_POP)
+        self.visit(node.right)
+        self.patch(jump)
+
+    def visit_Or(self, node):
+        self.visit(node.left)
+        jump = self.emit(JUMP_IF_TRUE_OR_POP)
+        self.visit(node.right)
+        self.patch(jump)
+
+    def visit_UnaryExpr(self, node):
+        self.visit(node.node)
+        self.emit(UNARY, _unary_operators.index(node.operator))
+
+    visit_Not = visit_Neg = visit_Pos = visit_UnaryExpr
+
+    def visit_Compare(self, node):
+        # Chained like Python: the first false comparison is the result, and later operands are not evaluated
+        self.visit(node.expr)
+        jumps = []
+        for op in node.ops[:-1]:
+            self.visit(op.expr)
+            jumps.append(self.emit(COMPARE_OR_JUMP, _compare_operators.index(op.operator)))
+        self.visit(node.ops[-1].expr)
+        self.emit(COMPARE, _compare_operators.index(node.ops[-1].operator))
+        for index in jumps:
+            self.code[index + 1] |= len(self.code) << _compare_operator_bits
+
+    def visit_GetAttr(self, node):
+        if isinstance(node.node, Node.Variable):
+            self.emit(LOAD_ATTR, self.constant((node.node.name, node.attr)))
+        else:
+            self.visit(node.node)
+            self.emit(GETATTR, self.constant(node.attr))
+
+    def visit_GetItem(self, node):
+        self.visit(node.node)
+        self.visit(node.name)
+        self.emit(GETITEM)
+
+    def visit_Call(self, node):
+        self.visit(node.node)
+        for arg in node.args:
+            self.visit(arg)
+        # In the order of the generated code: *dyn_args is evaluated before the keyword arguments
+        if node.dyn_args is not None:
+            self.visit(node.dyn_args)
+        for kwarg in node.kwargs:
+            self.visit(kwarg.value)
+        if node.dyn_kwargs is not None:
+            self.visit(node.dyn_kwargs)
+        keywords = tuple(kwarg.key.name for kwarg in node.kwargs)
+        self.emit(CALL, self.constant((len(node.args), keywords, node.dyn_args is not None,
+                                       node.dyn_kwargs is not None)))
+
+
+def assemble(node):
+    return Assembler().assemble(node)
+
+
+def execute(program, context):
+    """ Renders program with context, a Node.Context """
+    # Indexing a list is faster than indexing an array, which creates an int object each time
+    code = program.code.tolist()
+    constants = program.constants
+    resolve = Node.resolve_in_context
+    buffer = []
+    write = buffer.append
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    position = 0
+
+    # The most frequent instructions are tested first
+    while True:
+        opcode = code[position]
+        operand = code[position + 1]
+        position += 2
+
+        if opcode == 0:  # OUTPUT_CONSTANT
+            write(constants[operand])
+        elif opcode == 2:  # CONSTANT
+            push(constants[operand])
+        elif opcode == 3:  # LOAD
+            push(resolve(constants[operand], context))
+        elif opcode == 4:  # LOAD_ATTR
+            name, attr = constants[operand]
+            push(getattr(resolve(name, context), attr))
+        elif opcode == 1:  # OUTPUT
+            write(str(pop()))
+        elif opcode == 8:  # BINARY
+            right = pop()
+            stack[-1] = _binary_functions[operand](stack[-1], right)
+        elif opcode == 23:  # FOR_ITER
+            item = next(stack[-1], _exhausted)
+            if item is _exhausted:
+                pop()
+                position = pop()
+            else:
+                context.append({constants[operand]: item})
+        elif opcode == 24:  # END_FOR
+            context.pop()
+            position = operand
+        elif opcode == 13:  # JUMP_IF_FALSE
+            if not pop():
+                position = operand
+        elif opcode == 12:  # JUMP
+            position = operand
+        elif opcode == 5:  # GETATTR
+            stack[-1] = getattr(stack[-1], constants[operand])
+        elif opcode == 6:  # GETITEM
+            key = pop()
+            stack[-1] = stack[-1][key]
+        elif opcode == 7:  # CALL
+            count, keywords, has_dyn_args, has_dyn_kwargs = constants[operand]
+            dyn_kwargs = pop() if has_dyn_kwargs else {}
+            kwargs = {}
+            if keywords:
+                kwargs = dict(zip(keywords, stack[len(stack) - len(keywords):]))
+                del stack[len(stack) - len(keywords):]
+            dyn_args = pop() if has_dyn_args else ()
+            args = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            stack[-1] = stack[-1](*args, *dyn_args, **kwargs, **dyn_kwargs)
+        elif opcode == 10:  # COMPARE
+            right = pop()
+            stack[-1] = _compare_functions[operand](stack[-1], right)
+        elif opcode == 11:  # COMPARE_OR_JUMP
+            right = pop()
+            result = _compare_functions[operand & _compare_operator_mask](stack[-1], right)
+            if result:
+                stack[-1] = right
+            else:
+                stack[-1] = result
+                position = operand >> _compare_operator_bits
+        elif opcode == 14:  # JUMP_IF_FALSE_OR_POP
+            if stack[-1]:
+                pop()
+            else:
+                position = operand
+        elif opcode == 15:  # JUMP_IF_TRUE_OR_POP
+            if stack[-1]:
+                position = operand
+            else:
+                pop()
+        elif opcode == 9:  # UNARY
+            stack[-1] = _unary_functions[operand](stack[-1])
+        elif opcode == 16:  # TO_STRING
+            stack[-1] = str(stack[-1])
+        elif opcode == 22:  # GET_ITER
+            iterator = iter(stack[-1])
+            stack[-1] = operand
+            push(iterator)
+        elif opcode == 18:  # BUILD_LIST
+            values = stack[len(stack) - operand:]
+            del stack[len(stack) - operand:]
+            push(values)
+        elif opcode == 19:  # BUILD_TUPLE
+            values = tuple(stack[len(stack) - operand:])
+            del stack[len(stack) - operand:]
+            push(values)
+        elif opcode == 20:  # BUILD_DICT
+            values = stack[len(stack) - 2 * operand:]
+            del stack[len(stack) - 2 * operand:]
+            push(dict(zip(values[::2], values[1::2])))
+        elif opcode == 21:  # BUILD_SLICE
+            step = pop()
+            stop = pop()
+            stack[-1] = slice(stack[-1], stop, step)
+        elif opcode == 17:  # MISSING_ELSE
+            missing_else()
+        elif opcode == 25:  # RETURN
+            return ''.join(buffer)
+        else:
+            raise ValueError('Unknown opcode %d at %d' % (opcode, position - 2))
@@ -0,0 +1,73 @@
+import unittest
+from Lexer import Lexer
+import Node
+from Parser import Parser
+import ParserTest
+import VirtualMachine
+
+
+class VirtualMachineTest(ParserTest.ParserTest):
+    """ Runs every parser test again through the instruction stream """
+
+    def assemble(self, source):
+        return VirtualMachine.assemble(Parser(Lexer(), source).parse())
+
+    def render_outputs(self, parsed_source):
+        program = VirtualMachine.assemble(parsed_source)
+        return [program.render(self.items), VirtualMachine.Program.loads(program.dumps()).render(self.items)]
+
+    def test_matches_reference_renderer(self):
+        source = ('{% for i in range(6) %}{% if odd(i) and i > 1 or i == 0 %}{{ i * 2 }}{% elif 1 < i < 4 %}'
+                  '{{ [i, (i, ), {i: i}][0:2] }}{% else %}-{% endif %}{{ "x" if i else "y" }}{% endfor %}')
+        parsed_source = Parser(Lexer(), source).parse()
+        self.assertEqual(parsed_source.render({}), VirtualMachine.assemble(parsed_source).render({}))
+
+    def test_chained_comparison_stops_at_first_false(self):
+        calls = []
+
+        def value(x):
+            calls.append(x)
+            return x
+
+        def call(x):
+            return Node.Call(Node.Variable('f'), [Node.Value(x)], [], None, None)
+
+        # The parser nests chained comparisons, so the tree is built by hand
+        compare = Node.Compare(call(1), [Node.Operand('lt', call(0)), Node.Operand('lt', call(2))])
+        program = VirtualMachine.assemble(Node.Template([compare]))
+        self.assertEqual('False', program.render({'f': value}))
+        self.assertEqual([1, 0], calls)
+        self.assertEqual('True', VirtualMachine.assemble(Node.Template([Node.Compare(call(-1), compare.ops)])).render({'f': value}))
+
+    def test_calls_with_keyword_and_dynamic_arguments(self):
+        call = Node.Call(Node.Variable('f'), [Node.Value(1)], [Node.KeyWordArgument(Node.Variable('c'), Node.Value(2))],
+                         Node.Variable('a'), Node.Variable('k'))
+        program = VirtualMachine.assemble(Node.Template([call]))
+        result = program.render({'f': lambda *args, **kwargs: (args, sorted(kwargs.items())), 'a': [3], 'k': {'d': 4}})
+        self.assertEqual(str(((1, 3), [('c', 2), ('d', 4)])), result)
+
+    def test_cond_without_else_raises(self):
+        program = self.assemble('{{ 1 if foo }}')
+        self.assertEqual('1', program.render({'foo': True}))
+        self.assertRaises(Exception, program.render, {'foo': False})
+
+    def test_loop_scopes_are_popped(self):
+        program = self.assemble('{% for i in a %}{% for i in b %}{{ i }}{% endfor %}{{ i }}{% endfor %}{{ i }}')
+        self.assertEqual('xy1xy2!', program.render({'a': [1, 2], 'b': 'xy', 'i': '!'}))
+
+    def test_constants_are_shared_but_keep_their_type(self):
+        program = self.assemble('{{ 1 }}{{ 1.0 }}{{ True }}{{ 1 }}')
+        self.assertEqual('11.0True1', program.render())
+        self.assertEqual(3, len(program.constants))
+
+    def test_disassemble(self):
+        self.assertEqual('   0 LOAD                 0\n   2 OUTPUT               0\n   4 RETURN               0',
+                         self.assemble('{{ a }}').disassemble())
+
+    def test_opcode_names_follow_opcodes(self):
+        for opcode, name in enumerate(VirtualMachine.opcode_names):
+            self.assertEqual(opcode, getattr(VirtualMachine, name))
+
+
+if __name__ == '__main__':
+    unittest.main()